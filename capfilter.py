@@ -0,0 +1,357 @@
+'''
+Capture filters, checked against the raw bytes of each frame before it is
+dissected by dpkt.
+
+The language is a small subset of tcpdump's:
+
+  [src|dst] host ADDR         IPv4 or IPv6 address
+  [src|dst] net ADDR/LEN      CIDR block
+  [src|dst] port N            TCP, UDP or SCTP port
+  proto NAME|N                IP protocol, like tcp, udp, icmp or 47
+  ip, ip6, tcp, udp, icmp     shorthands; `tcp port 80` means tcp and port 80
+  not, and, or, ( )           also !, && and ||
+
+A filter is parsed and compiled once, into a tree of closures that read
+fixed offsets of the network and transport headers. Frames that are too
+short for a test don't match it. The network header is found with
+linklayer.LOCATORS.
+'''
+
+import linklayer
+import re
+import socket
+import struct
+
+class FilterError(ValueError):
+    '''
+    Raised when a filter expression can't be parsed.
+    '''
+    pass
+
+PROTOCOLS = {'icmp': 1, 'tcp': 6, 'udp': 17, 'icmp6': 58, 'sctp': 132}
+PORT_PROTOCOLS = (6, 17, 132)
+
+unpack_short = struct.Struct('>H').unpack_from
+
+# primitives: take (buf, off, family), return bool
+
+def match_family(family):
+    def pred(buf, off, fam):
+        return fam == family
+    return pred
+
+def match_proto(proto):
+    def pred(buf, off, fam):
+        if fam == 4:
+            return ord(buf[off+9]) == proto
+        elif fam == 6:
+            return ord(buf[off+6]) == proto
+        return False
+    return pred
+
+# offsets of (src, dst) addresses from the start of the network header
+ADDR_OFFSETS = {4: (12, 16), 6: (8, 24)}
+
+def match_net(family, addr, prefixlen, which):
+    '''
+    which = indexes into ADDR_OFFSETS[family]: (0,), (1,) or (0, 1)
+    '''
+    offsets = [ADDR_OFFSETS[family][i] for i in which]
+    nbytes, nbits = divmod(prefixlen, 8)
+    prefix = addr[:nbytes]
+    if nbits:
+        mask = (0xff << (8 - nbits)) & 0xff
+        lastbyte = ord(addr[nbytes]) & mask
+    def pred(buf, off, fam):
+        if fam != family:
+            return False
+        for o in offsets:
+            start = off + o
+            if buf[start:start+nbytes] != prefix:
+                continue
+            if nbits and ord(buf[start+nbytes]) & mask != lastbyte:
+                continue
+            return True
+        return False
+    return pred
+
+def match_port(port, which):
+    '''
+    which = (0,) for src, (2,) for dst, (0, 2) for either
+    '''
+    def pred(buf, off, fam):
+        if fam == 4:
+            if ord(buf[off+9]) not in PORT_PROTOCOLS:
+                return False
+            # later fragments have no transport header
+            if unpack_short(buf, off+6)[0] & 0x1fff:
+                return False
+            l4 = off + (ord(buf[off]) & 0xf) * 4
+        elif fam == 6:
+            # extension headers are not followed
+            if ord(buf[off+6]) not in PORT_PROTOCOLS:
+                return False
+            l4 = off + 40
+        else:
+            return False
+        for o in which:
+            if unpack_short(buf, l4 + o)[0] == port:
+                return True
+        return False
+    return pred
+
+def match_not(a):
+    return lambda buf, off, fam: not a(buf, off, fam)
+
+def match_and(a, b):
+    return lambda buf, off, fam: a(buf, off, fam) and b(buf, off, fam)
+
+def match_or(a, b):
+    return lambda buf, off, fam: a(buf, off, fam) or b(buf, off, fam)
+
+# parsing
+
+TOKEN_RE = re.compile(r'\(|\)|&&|\|\||!|[^\s()!&|]+')
+ALIASES = {'&&': 'and', '||': 'or', '!': 'not'}
+
+class Parser(object):
+    '''
+    Recursive descent parser for filter expressions. Produces the compiled
+    predicate directly.
+    '''
+    def __init__(self, expr):
+        self.tokens = [ALIASES.get(t, t) for t in TOKEN_RE.findall(expr)]
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def next(self, expected=None):
+        tok = self.peek()
+        if tok is None:
+            raise FilterError('unexpected end of filter')
+        if expected and tok != expected:
+            raise FilterError('expected %s, got %s' % (expected, tok))
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        pred = self.expr()
+        if self.peek() is not None:
+            raise FilterError('unexpected %s in filter' % self.peek())
+        return pred
+
+    def expr(self):
+        pred = self.term()
+        while self.peek() == 'or':
+            self.next()
+            pred = match_or(pred, self.term())
+        return pred
+
+    def term(self):
+        pred = self.factor()
+        while self.peek() == 'and':
+            self.next()
+            pred = match_and(pred, self.factor())
+        return pred
+
+    def factor(self):
+        tok = self.next()
+        if tok == 'not':
+            return match_not(self.factor())
+        elif tok == '(':
+            pred = self.expr()
+            self.next(')')
+            return pred
+        elif tok == 'ip':
+            return match_family(4)
+        elif tok == 'ip6':
+            return match_family(6)
+        elif tok == 'proto':
+            return match_proto(self.protocol(self.next()))
+        elif tok in PROTOCOLS:
+            pred = match_proto(PROTOCOLS[tok])
+            # `tcp port 80`, `udp src host x`
+            if self.peek() in ('src', 'dst', 'host', 'net', 'port'):
+                pred = match_and(pred, self.qualified(self.next()))
+            return pred
+        return self.qualified(tok)
+
+    def qualified(self, tok):
+        which = (0, 1)
+        if tok in ('src', 'dst'):
+            which = (0,) if tok == 'src' else (1,)
+            tok = self.next()
+            if tok not in ('host', 'net', 'port'):
+                # `src 10.0.0.1` is short for `src host 10.0.0.1`
+                self.pos -= 1
+                tok = 'host'
+        if tok == 'host':
+            family, addr = self.address(self.next())
+            return match_net(family, addr, len(addr) * 8, which)
+        elif tok == 'net':
+            spec = self.next()
+            addr, _, prefixlen = spec.partition('/')
+            family, addr = self.address(addr)
+            try:
+                prefixlen = int(prefixlen) if prefixlen else len(addr) * 8
+            except ValueError:
+                raise FilterError('invalid prefix length in %s' % spec)
+            if not 0 <= prefixlen <= len(addr) * 8:
+                raise FilterError('invalid prefix length in %s' % spec)
+            return match_net(family, addr, prefixlen, which)
+        elif tok == 'port':
+            port = self.next()
+            if not port.isdigit() or int(port) > 0xffff:
+                raise FilterError('invalid port %s' % port)
+            return match_port(int(port), tuple(2 * i for i in which))
+        raise FilterError('unknown filter primitive %s' % tok)
+
+    def address(self, text):
+        '''
+        Returns (family, packed address).
+        '''
+        for family, af in ((4, socket.AF_INET), (6, socket.AF_INET6)):
+            try:
+                return family, socket.inet_pton(af, text)
+            except socket.error:
+                pass
+        raise FilterError('invalid address %s' % text)
+
+    def protocol(self, text):
+        if text in PROTOCOLS:
+            return PROTOCOLS[text]
+        if text.isdigit() and int(text) < 256:
+            return int(text)
+        raise FilterError('unknown protocol %s' % text)
+
+class Filter(object):
+    '''
+    A compiled capture filter. Call match(buf, linktype) for each frame.
+
+    Members:
+    * expr = the filter expression
+    '''
+    def __init__(self, expr):
+        '''
+        Compiles expr. Raises FilterError if it is invalid.
+        '''
+        self.expr = expr
+        self.pred = Parser(expr).parse()
+
+    def match(self, buf, linktype):
+        '''
+        Whether the raw frame buf, of DLT_* type linktype, passes the filter.
+        Frames of unknown link types are let through, for dpkt to sort out.
+        '''
+        locate = linklayer.LOCATORS.get(linktype)
+        if locate is None:
+            return True
+        try:
+            off, family = locate(buf)
+            return self.pred(buf, off, family)
+        except (struct.error, IndexError):
+            # frame too short
+            return False
+
+if __name__ == '__main__':
+    import unittest
+
+    def ip4(src, dst, proto, payload, frag=0):
+        header = struct.pack('>BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0,
+                             frag, 64, proto, 0, socket.inet_aton(src),
+                             socket.inet_aton(dst))
+        return header + payload
+
+    def ports(sport, dport):
+        # enough of a TCP/UDP header for the ports
+        return struct.pack('>HHII', sport, dport, 0, 0)
+
+    def ethernet(packet, ethertype=0x0800, vlans=()):
+        frame = '\x00' * 12
+        for vlan in vlans:
+            frame += struct.pack('>HH', vlan, 1)
+        return frame + struct.pack('>H', ethertype) + packet
+
+    def sll(packet, ethertype=0x0800):
+        return '\x00' * 14 + struct.pack('>H', ethertype) + packet
+
+    DLT_NULL, DLT_EN10MB, DLT_LINUX_SLL = 0, 1, 113
+
+    TCP_80 = ip4('10.0.0.1', '10.0.0.2', 6, ports(40000, 80))
+    UDP_53 = ip4('10.0.0.2', '192.168.1.7', 17, ports(53, 1234))
+    # a later fragment of a TCP packet, with bytes where the ports would be
+    # that say 80
+    FRAGMENT = ip4('10.0.0.1', '10.0.0.2', 6, ports(80, 80), frag=185)
+
+    class TestFilter(unittest.TestCase):
+        def assertMatches(self, expr, frame, linktype=DLT_EN10MB,
+                          result=True):
+            self.assertEqual(Filter(expr).match(frame, linktype), result,
+                             '%r on %r' % (expr, frame))
+
+        def assertNotMatches(self, expr, frame, linktype=DLT_EN10MB):
+            self.assertMatches(expr, frame, linktype, False)
+
+        def test_parse_errors(self):
+            for expr in ('', 'host', 'host 10.0.0', 'port 70000',
+                         'port http', 'net 10.0.0.0/33', 'net 10.0.0.0/x',
+                         'proto 300', 'proto bogus', 'tcp and', '(tcp',
+                         'tcp)', 'foo', 'src 10.0.0.1 10.0.0.2'):
+                self.assertRaises(FilterError, Filter, expr)
+            Filter('not (src host ::1 or dst net 10.0.0.0/8) && ! tcp')
+
+        def test_primitives(self):
+            frame = ethernet(TCP_80)
+            for expr in ('ip', 'tcp', 'proto 6', 'host 10.0.0.2',
+                         'src host 10.0.0.1', 'dst 10.0.0.2',
+                         'net 10.0.0.0/8', 'src net 10.0.0.0/31',
+                         'port 80', 'dst port 80', 'tcp port 40000'):
+                self.assertMatches(expr, frame)
+            for expr in ('ip6', 'udp', 'icmp', 'host 10.0.0.3',
+                         'dst host 10.0.0.1', 'net 192.168.0.0/16',
+                         'src net 10.0.0.2/32', 'src port 80',
+                         'port 443', 'udp port 80'):
+                self.assertNotMatches(expr, frame)
+
+        def test_operators(self):
+            frame = ethernet(UDP_53)
+            self.assertMatches('udp and port 53', frame)
+            self.assertMatches('tcp or port 53', frame)
+            self.assertMatches('not tcp', frame)
+            self.assertMatches('! (tcp || host 10.0.0.1)', frame)
+            self.assertNotMatches('udp && not port 53', frame)
+            # and binds tighter than or
+            self.assertMatches('tcp and port 80 or udp', frame)
+            self.assertNotMatches('tcp and (port 80 or udp)', frame)
+
+        def test_fragments(self):
+            frame = ethernet(FRAGMENT)
+            self.assertMatches('tcp and host 10.0.0.1', frame)
+            self.assertNotMatches('port 80', frame)
+            self.assertMatches('not port 80', frame)
+
+        def test_link_layers(self):
+            for frame, linktype in (
+                (ethernet(TCP_80, vlans=(0x8100,)), DLT_EN10MB),
+                (ethernet(TCP_80, vlans=(0x88a8, 0x8100)), DLT_EN10MB),
+                (sll(TCP_80), DLT_LINUX_SLL),
+                ('\x02\x00\x00\x00' + TCP_80, DLT_NULL),
+                ):
+                self.assertMatches('tcp port 80 and host 10.0.0.1', frame,
+                                   linktype)
+                self.assertNotMatches('udp or port 443', frame, linktype)
+            # ARP isn't IP
+            arp = ethernet('\x00' * 28, ethertype=0x0806)
+            self.assertNotMatches('host 10.0.0.1', arp)
+            self.assertMatches('not ip', arp)
+
+        def test_short_frames(self):
+            self.assertNotMatches('port 80', ethernet(TCP_80)[:36])
+            self.assertNotMatches('tcp', '\x00' * 10)
+            # unknown link types are left to dpkt
+            self.assertMatches('tcp', 'junk', 147)
+
+    unittest.main()
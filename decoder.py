@@ -0,0 +1,72 @@
+'''
+Fast path for turning raw frames into tcp.Packet's without dpkt.
+
+dpkt builds an Ethernet, an IP and a TCP object for every frame, and copies
+the payload at each layer. All tcp.Packet needs is the addresses, ports,
+seq, ack, flags and payload, so for plain TCP over IPv4/IPv6 we unpack those
+straight out of the frame with precompiled structs, and take the payload as
+a buffer into the frame. Anything unusual (fragments, IPv6 extension
+headers, non-TCP, truncated frames) is left to dpkt by returning None.
+'''
+
+import struct
+import linklayer
+import tcp
+
+# version/ihl, tos, total length, id, flags/fragment offset, ttl, protocol,
+# checksum, src, dst
+ip4_header = struct.Struct('>BBHHHBBH4s4s')
+# version/class/flow label, payload length, next header, hop limit, src, dst
+ip6_header = struct.Struct('>IHBB16s16s')
+# sport, dport, seq, ack, data offset/flags
+tcp_header = struct.Struct('>HHIIH')
+
+IP_PROTO_TCP = 6
+IP_MF = 0x2000
+IP_OFFMASK = 0x1fff
+TCP_FLAGS_MASK = 0x1ff
+
+def decode_tcp(ts, buf, linktype):
+    '''
+    Returns a tcp.Packet for the frame, or None if it is not a TCP segment
+    the fast path can handle, in which case it should go through dpkt.
+
+    Args:
+    ts = timestamp
+    buf = raw frame, string or buffer
+    linktype = DLT_* value of the frame
+    '''
+    locate = linklayer.LOCATORS.get(linktype)
+    if locate is None:
+        return None
+    try:
+        off, family = locate(buf)
+        if family == 4:
+            (v_hl, _, iplen, _, frag, _, proto, _, src, dst
+                ) = ip4_header.unpack_from(buf, off)
+            if proto != IP_PROTO_TCP or frag & (IP_MF | IP_OFFMASK):
+                return None
+            l4 = off + ((v_hl & 0xf) << 2)
+            # iplen is 0 with TCP segmentation offload
+            end = off + iplen if iplen else len(buf)
+            if end < l4 or end > len(buf):
+                return None
+        elif family == 6:
+            _, plen, nxt, _, src, dst = ip6_header.unpack_from(buf, off)
+            if nxt != IP_PROTO_TCP:
+                return None
+            l4 = off + 40
+            end = l4 + plen
+            if end > len(buf):
+                return None
+        else:
+            return None
+        sport, dport, seq, ack, off_flags = tcp_header.unpack_from(buf, l4)
+    except (struct.error, IndexError):
+        return None
+    start = l4 + ((off_flags >> 12) << 2)
+    if start > end or start < l4 + 20:
+        return None
+    data = buffer(buf, start, end - start) if end > start else ''
+    return tcp.Packet(ts, ((src, sport), (dst, dport)),
+                      seq, ack, off_flags & TCP_FLAGS_MASK, data)
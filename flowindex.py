@@ -0,0 +1,266 @@
+'''
+Flow index sidecar files, for converting selected TCP flows out of a big
+capture without reparsing all of it.
+
+The first run makes an indexing pass over the capture and saves, for each
+TCP flow, the file offsets of its packets next to the capture, in
+<capture>.p2hidx. Later runs load the index and read just the records of the
+flows they want. Only classic libpcap files can be indexed, since the
+records have to be read in place through pcaputil.MmapReader.
+
+DNS packets are indexed too, and always read along with the selected flows,
+so the HAR still gets DNS timings.
+'''
+
+import array
+import dpkt
+import os
+import socket
+import struct
+import logging as log
+import pcap
+from decoder import decode_tcp
+from pcaputil import MmapReader
+
+SUFFIX = '.p2hidx'
+MAGIC = 'P2HX'
+VERSION = 2
+
+# magic, version, capture size, capture mtime, number of flows, number of
+# DNS packets
+file_header = struct.Struct('<4sHQdII')
+# first_ts, last_ts, packets, payload bytes, followed by the file offset of
+# each packet, as 64 bit ints since packets of one flow can be more than 4GB
+# apart
+entry_header = struct.Struct('<ddIQ')
+
+# offsets need 64 bits. 'Q' only exists from python 3.3, and a C long is 32
+# bits on Windows and 32-bit builds, where a double holds them exactly
+try:
+    OFFSET_TYPECODE = array.array('Q').typecode
+except ValueError:
+    OFFSET_TYPECODE = 'L' if array.array('L').itemsize >= 8 else 'd'
+
+class IndexEntry(object):
+    '''
+    Where the packets of one TCP flow are in the capture.
+
+    Members:
+    * socket = ((srcip, sport), (dstip, dport)), from the flow's first packet
+    * offsets = array of file offsets of the flow's records, in file order
+    * first_ts, last_ts = timestamps of the first and last packets
+    * packets = number of packets
+    * bytes = TCP payload bytes, both directions
+    '''
+    def __init__(self, sock):
+        self.socket = sock
+        self.offsets = array.array(OFFSET_TYPECODE)
+        self.first_ts = None
+        self.last_ts = None
+        self.packets = 0
+        self.bytes = 0
+    def add(self, offset, ts, nbytes):
+        self.offsets.append(offset)
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.packets += 1
+        self.bytes += nbytes
+    def matches(self, host, port):
+        '''
+        Whether either end of the flow has the passed host and port. host is
+        a packed address or None, port an int or None; None matches anything.
+        '''
+        for addr, p in self.socket:
+            if (host is None or addr == host) and (port is None or p == port):
+                return True
+        return False
+
+class FlowIndex(object):
+    '''
+    The flows of a capture and where their packets are.
+
+    Members:
+    * entries = {socket: IndexEntry}, keyed like tcp.FlowBuilder.flowdict
+    * dns_offsets = array of file offsets of UDP port 53 records
+    * size, mtime = of the capture, to notice when the index is stale
+    '''
+    def __init__(self, size, mtime):
+        self.entries = {}
+        self.dns_offsets = array.array(OFFSET_TYPECODE)
+        self.size = size
+        self.mtime = mtime
+
+    @classmethod
+    def build(cls, reader, filename):
+        '''
+        Makes the indexing pass over a pcaputil.MmapReader of filename. Frames
+        are decoded the way pcap.ParsePcap does it, with decoder.decode_tcp
+        and dpkt for what that can't handle, so the same packets count as TCP.
+        '''
+        st = os.stat(filename)
+        index = cls(st.st_size, st.st_mtime)
+        entries = index.entries
+        for offset, ts, buf, hdr in reader.records():
+            pkt = decode_tcp(ts, buf, hdr.linktype)
+            if pkt:
+                src, dst = pkt.socket
+                nbytes = len(pkt.data)
+            else:
+                try:
+                    ip = pcap.parse_frame(buf, hdr.linktype).data
+                except dpkt.Error:
+                    continue
+                if not isinstance(ip, (dpkt.ip.IP, dpkt.ip6.IP6)):
+                    continue
+                tcp = ip.data
+                if (isinstance(tcp, dpkt.udp.UDP) and
+                    53 in (tcp.sport, tcp.dport)):
+                    index.dns_offsets.append(offset)
+                if not isinstance(tcp, dpkt.tcp.TCP):
+                    continue
+                src, dst = (ip.src, tcp.sport), (ip.dst, tcp.dport)
+                nbytes = len(tcp.data)
+            if (src, dst) in entries:
+                entry = entries[(src, dst)]
+            elif (dst, src) in entries:
+                entry = entries[(dst, src)]
+            else:
+                entry = entries[(src, dst)] = IndexEntry((src, dst))
+            entry.add(offset, ts, nbytes)
+        return index
+
+    def is_current(self, filename):
+        '''
+        Whether the index still describes the capture file.
+        '''
+        st = os.stat(filename)
+        return st.st_size == self.size and st.st_mtime == self.mtime
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(file_header.pack(MAGIC, VERSION, self.size, self.mtime,
+                                     len(self.entries), len(self.dns_offsets)))
+            f.write(struct.pack('<%dQ' % len(self.dns_offsets),
+                                *map(int, self.dns_offsets)))
+            for entry in self.entries.itervalues():
+                (srcip, sport), (dstip, dport) = entry.socket
+                f.write(struct.pack('<B', len(srcip)))
+                f.write(srcip + struct.pack('<H', sport))
+                f.write(dstip + struct.pack('<H', dport))
+                f.write(entry_header.pack(entry.first_ts, entry.last_ts,
+                                          entry.packets, entry.bytes))
+                f.write(struct.pack('<%dQ' % len(entry.offsets),
+                                    *map(int, entry.offsets)))
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Reads an index saved with save(). Raises ValueError if the file is not
+        an index this version understands.
+        '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, size, mtime, nflows, ndns = \
+            file_header.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a pcap2har flow index: %s' % path)
+        index = cls(size, mtime)
+        pos = file_header.size
+        index.dns_offsets.extend(
+            struct.unpack_from('<%dQ' % ndns, data, pos))
+        pos += 8 * ndns
+        for i in xrange(nflows):
+            addrlen = ord(data[pos])
+            pos += 1
+            srcip = data[pos:pos+addrlen]
+            sport, = struct.unpack_from('<H', data, pos+addrlen)
+            pos += addrlen + 2
+            dstip = data[pos:pos+addrlen]
+            dport, = struct.unpack_from('<H', data, pos+addrlen)
+            pos += addrlen + 2
+            entry = IndexEntry(((srcip, sport), (dstip, dport)))
+            (entry.first_ts, entry.last_ts, entry.packets, entry.bytes
+                ) = entry_header.unpack_from(data, pos)
+            pos += entry_header.size
+            entry.offsets.extend(
+                struct.unpack_from('<%dQ' % entry.packets, data, pos))
+            pos += 8 * entry.packets
+            index.entries[entry.socket] = entry
+        return index
+
+    def select(self, specs):
+        '''
+        Returns the IndexEntry's matching any of the (host, port) specs, as
+        returned by parse_flow_spec.
+        '''
+        return [e for e in self.entries.itervalues()
+                if any(e.matches(host, port) for host, port in specs)]
+
+class SelectedReader(object):
+    '''
+    Reads only the records of the passed flows, plus extra_offsets, from a
+    pcaputil.MmapReader, in file order. Usable as the reader argument of
+    pcap.ParsePcap.
+    '''
+    def __init__(self, reader, entries, extra_offsets=()):
+        self.reader = reader
+        self.name = reader.name
+        self.offsets = [int(o) for e in entries for o in e.offsets]
+        self.offsets.extend(int(o) for o in extra_offsets)
+        self.offsets.sort()
+    def datalink(self):
+        return self.reader.datalink()
+    def __iter__(self):
+        return self.reader.read_at(self.offsets)
+
+def parse_flow_spec(spec):
+    '''
+    Parses a flow selector from the command line: HOST:PORT, HOST, or :PORT.
+    IPv6 addresses with a port go in brackets, like [::1]:80. Returns
+    (packed address or None, port or None).
+    '''
+    host, port = spec, None
+    if spec.startswith('['):
+        host, _, port = spec[1:].partition(']')
+        port = port.lstrip(':')
+    elif spec.count(':') == 1:
+        host, port = spec.split(':')
+    if host:
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        host = socket.inet_pton(family, host)
+    return host or None, int(port) if port else None
+
+def indexed_reader(filename, specs=None):
+    '''
+    Opens a capture through its flow index, building and saving the index
+    first if it is missing or stale. Returns a reader for pcap.ParsePcap that
+    yields only the flows matching specs ([(host, port)]), or all packets if
+    specs is empty. Returns None if the file is not a valid capture.
+    '''
+    reader = pcap.open_file(filename)
+    if not isinstance(reader, MmapReader):
+        if reader:
+            log.warning('%s cannot be indexed, reading all of it' % filename)
+        return reader
+    path = filename + SUFFIX
+    index = None
+    if os.path.exists(path):
+        try:
+            index = FlowIndex.load(path)
+        except (ValueError, struct.error) as e:
+            log.warning('ignoring unreadable flow index %s: %s' % (path, e))
+        else:
+            if not index.is_current(filename):
+                log.info('flow index %s is stale' % path)
+                index = None
+    if not index:
+        log.info('building flow index %s' % path)
+        index = FlowIndex.build(reader, filename)
+        index.save(path)
+    if not specs:
+        return reader
+    entries = index.select(specs)
+    log.info('%d of %d flows selected from index' %
+             (len(entries), len(index.entries)))
+    return SelectedReader(reader, entries, index.dns_offsets)
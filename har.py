@@ -1,5 +1,6 @@
 import http
 import json
+import settings
 
 '''
 functions and classes for generating HAR data from parsed http data
@@ -39,25 +40,38 @@ def HTTPRequestJsonRepr(self):
         'queryString': query_json_repr(self.query),
         'headersSize': -1,
         'headers': header_json_repr(self.msg.headers),
-        'bodySize': len(self.msg.body),
+        'bodySize': self.msg.body_size,
     }
 http.Request.json_repr = HTTPRequestJsonRepr
 
 def HTTPResponseJsonRepr(self):
-    content =  {
-        'size': len(self.body),
-        'compression': len(self.body) - len(self.raw_body),
-        'mimeType': self.mimeType
-    }
-    if self.text:
-        content['text'] = self.text.encode('utf8') # must transcode to utf8
+    '''
+    self = http.Response. Its body is only decoded if settings.include_content
+    is set, and is dropped again once it has been used.
+    '''
+    if not settings.include_content or self.truncated:
+        # the decoded size isn't known
+        content = {
+            'size': self.msg.body_size,
+            'compression': 0,
+            'mimeType': self.mimeType
+        }
+    else:
+        content =  {
+            'size': len(self.body),
+            'compression': len(self.body) - len(self.raw_body),
+            'mimeType': self.mimeType
+        }
+        if self.text:
+            content['text'] = self.text.encode('utf8') # must transcode to utf8
+        self.drop_content()
     return {
         'status': int(self.msg.status),
         'statusText': self.msg.reason,
         'httpVersion': self.msg.version,
         'cookies': [],
         'headersSize': -1,
-        'bodySize': len(self.msg.body),
+        'bodySize': self.msg.body_size,
         'redirectURL': self.msg.headers['location'] if 'location' in self.msg.headers else '',
         'headers': header_json_repr(self.msg.headers),
         'content': content,
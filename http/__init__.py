@@ -2,6 +2,7 @@ from message import Message
 from request import Request
 from response import Response
 from flow import Flow
+from stream import FlowParser
 
 class Error(Exception):
     '''
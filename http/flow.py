@@ -2,6 +2,7 @@ import logging
 import dpkt
 import http
 from http import Request, Response
+from sniff import start_line_kind
 
 class Flow:
     '''
@@ -19,13 +20,9 @@ class Flow:
         '''
         tcpflow = tcp.Flow
         '''
-        # try parsing it with forward as request dir
-        success, requests, responses = parse_streams(tcpflow.fwd, tcpflow.rev)
-        if not success:
-            success, requests, responses = parse_streams(tcpflow.rev, tcpflow.fwd)
-            if not success:
-                # flow is not HTTP
-                raise HTTPError('TCP Flow does not contain HTTP')
+        request_stream, response_stream = find_streams(tcpflow)
+        requests = gather_messages(Request, request_stream)
+        responses = gather_messages(Response, response_stream)
         # match up requests with nearest response that occured after them
         # first request is the benchmark; responses before that are irrelevant for now
         self.pairs = []
@@ -82,9 +79,9 @@ def gather_messages(MessageClass, tcpdir):
     '''
     messages = [] # [MessageClass]
     pointer = 0 # starting index of data that MessageClass should look at
+    end = len(tcpdir.data)
     # while there's data left
-    while pointer < len(tcpdir.data):
-        curr_data = tcpdir.data[pointer:pointer+200] # debug var
+    while pointer < end:
         try:
             msg = MessageClass(tcpdir, pointer)
         except dpkt.Error as error: # if the message failed
@@ -100,26 +97,25 @@ def gather_messages(MessageClass, tcpdir):
         pointer += msg.data_consumed
     return messages
 
-def parse_streams(request_stream, response_stream):
+def find_streams(tcpflow):
     '''
-    attempts to construct http.Request/Response's from the corresponding
-    passed streams. Failure may either mean that the streams are malformed or
-    they are simply switched
+    Works out which direction of the flow is the client's from the first line
+    of each, so that neither has to be parsed twice. fwd is usually the
+    client's, since it sent the SYN, but without a handshake it is just
+    whichever side sent the first packet.
     Args:
-    request_stream, response_stream = TCPDirection
+    tcpflow = tcp.Flow
     Returns:
-    True or False, whether parsing succeeded
-    request list or None
-    response list or None
+    (request_stream, response_stream), tcp.Direction's
+    Raises http.Error if neither direction starts with a message.
     '''
-    try:
-        requests = gather_messages(Request, request_stream)
-        responses = gather_messages(Response, response_stream)
-    except dpkt.UnpackError as e:
-        print 'failed to parse http: ', e
-        return False, None, None
-    else:
-        return True, requests, responses
+    fwd = start_line_kind(tcpflow.fwd.data)
+    rev = start_line_kind(tcpflow.rev.data)
+    if fwd is None and rev is None:
+        raise http.Error('TCP Flow does not contain HTTP')
+    if fwd == 'response' or rev == 'request':
+        return tcpflow.rev, tcpflow.fwd
+    return tcpflow.fwd, tcpflow.rev
 
 def find_index(f, seq):
     '''
@@ -0,0 +1,216 @@
+'''
+Support for reassembling HTTP streams with bodies cut short, when only the
+headers, sizes and timings are wanted (see settings.body_cap).
+
+BodySkipper follows the framing of the messages in a stream as its bytes
+arrive, and tells tcp.Direction which body bytes to throw away. It frames
+messages with the same functions as http.parser, which then reads the
+trimmed stream as if the bodies were all there. It also notes where each
+message ends, which http.MessageStream uses to parse messages as soon as
+they are complete.
+'''
+
+import dpkt
+import parser
+
+# give up on a stream if the headers go on for longer than this
+MAX_HEAD = 64 * 1024
+
+class BodySkipper(object):
+    '''
+    Decides which bytes of an HTTP stream to keep: all of the start lines,
+    headers, chunk-size lines and trailers, and the first cap bytes of each
+    body, or all of it if there is no cap. If the stream stops looking like
+    HTTP, everything from there on is kept, so that parsing fails the way it
+    would have anyway.
+
+    Members:
+    * cap = bytes of each body to keep, or None to keep them all
+    * state = what the next bytes are: 'head', 'body', 'size' or 'chunk'
+    (chunked body), 'chunk-end' (line after a chunk), 'trailer', 'rest' (body
+    that goes on to the end of the stream), or 'pass' (keep everything)
+    * kept = number of bytes kept so far
+    * ends = [int], where in the kept bytes each message so far has ended
+    * kind = 'request' or 'response', what the first message is, or None
+    until its headers have arrived
+    '''
+    def __init__(self, cap=None):
+        self.cap = cap
+        self.state = 'head'
+        self.kept = 0
+        self.ends = []
+        self.ended = False # whether feed_line finished a message
+        self.kind = None
+        self.line = '' # partial header block or line
+        self.scanned = 0 # how much of line has been searched for its end
+        self.remaining = 0 # bytes left in the body or chunk
+        self.body_kept = 0 # bytes of the current body kept so far
+
+    def feed(self, data):
+        '''
+        Takes the next bytes of the stream, in order. Returns [(start, end)],
+        the slices of data to keep.
+        '''
+        keep = []
+        pos = 0
+        end = len(data)
+        while pos < end:
+            if self.state == 'pass':
+                keep.append((pos, end))
+                self.kept += end - pos
+                break
+            elif self.state in ('body', 'chunk', 'rest'):
+                if self.state == 'rest':
+                    n = end - pos
+                else:
+                    n = min(self.remaining, end - pos)
+                if self.cap is None:
+                    kept = n
+                else:
+                    kept = max(0, min(n, self.cap - self.body_kept))
+                if kept:
+                    keep.append((pos, pos + kept))
+                    self.body_kept += kept
+                    self.kept += kept
+                pos += n
+                if self.state != 'rest':
+                    self.remaining -= n
+                    if not self.remaining:
+                        self.end_of_data()
+            else:
+                self.ended = False
+                used = self.feed_line(data, pos)
+                keep.append((pos, pos + used))
+                self.kept += used
+                pos += used
+                if self.ended:
+                    self.ends.append(self.kept)
+        # merge adjacent slices
+        merged = []
+        for start, stop in keep:
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], stop)
+            elif stop > start:
+                merged.append((start, stop))
+        return merged
+
+    def end_of_data(self):
+        '''
+        Called at the end of a body or chunk.
+        '''
+        if self.state == 'body':
+            self.state = 'head'
+            self.ends.append(self.kept)
+        else:
+            self.state = 'chunk-end'
+
+    def feed_line(self, data, pos):
+        '''
+        Adds data from pos to the partial header block or line, as far as its
+        end. Returns how many bytes were used.
+        '''
+        if self.state == 'head':
+            if self.line:
+                return self.feed_head_tail(data, pos)
+            # search data in place, so that a big feed isn't copied for
+            # every message in it
+            end = min(len(data), pos + MAX_HEAD + 1)
+            first = data.find('\n', pos, end)
+            m = None
+            if first >= 0:
+                m = parser.BLANK_LINE.search(data, first, end)
+            if m:
+                self.start_message(data[pos:m.end()])
+                return m.end() - pos
+            if end - pos > MAX_HEAD:
+                self.state = 'pass'
+            else:
+                # the headers go on in the next feed
+                self.line = data[pos:]
+                self.scanned = max(0, self.line.rfind('\n'))
+            return len(data) - pos
+        nl = data.find('\n', pos)
+        if nl < 0:
+            self.line += data[pos:]
+            if len(self.line) > MAX_HEAD:
+                self.state = 'pass'
+            return len(data) - pos
+        line = self.line + data[pos:nl+1]
+        self.line = ''
+        if self.state == 'size':
+            try:
+                self.remaining = int(line.split(None, 1)[0].split(';', 1)[0],
+                                     16)
+            except (IndexError, ValueError):
+                self.state = 'pass'
+                return nl + 1 - pos
+            self.state = 'chunk' if self.remaining else 'trailer'
+        elif self.state == 'chunk-end':
+            # the parser stops at anything but an empty line
+            self.state = 'pass' if line.strip() else 'size'
+        elif self.state == 'trailer':
+            if not line.strip():
+                self.state = 'head'
+                self.ended = True
+        return nl + 1 - pos
+
+    def feed_head_tail(self, data, pos):
+        '''
+        Like feed_line, for the rest of a header block that started in an
+        earlier feed.
+        '''
+        line = self.line + data[pos:pos + MAX_HEAD + 1 - len(self.line)]
+        first = line.find('\n')
+        m = None
+        if first >= 0:
+            m = parser.BLANK_LINE.search(line, max(first, self.scanned))
+        if not m:
+            if len(line) > MAX_HEAD:
+                self.state = 'pass'
+            else:
+                self.line = line
+                self.scanned = max(0, line.rfind('\n'))
+            return len(data) - pos
+        used = m.end() - len(self.line)
+        self.line = ''
+        self.scanned = 0
+        self.start_message(line[:m.end()])
+        return used
+
+    def start_message(self, head):
+        '''
+        Works out how the body of the message whose start line and headers
+        are head is framed.
+        '''
+        eol = head.find('\n')
+        line = head[:eol]
+        try:
+            if line.lstrip().startswith('HTTP'):
+                status = parser.parse_status_line(line)[1]
+                kind = 'response'
+            else:
+                parser.parse_request_line(line)
+                status = None
+                kind = 'request'
+            headers = parser.parse_headers(head[eol+1:])
+            framing, n = parser.body_framing(headers, status)
+        except dpkt.UnpackError:
+            self.state = 'pass'
+            return
+        if self.kind is None:
+            self.kind = kind
+        self.body_kept = 0
+        if framing == 'chunked':
+            self.state = 'size'
+        elif framing == 'length':
+            self.remaining = n
+            if n:
+                self.state = 'body'
+            else:
+                self.state = 'head'
+                self.ended = True
+        elif framing == 'close':
+            self.state = 'rest'
+        else:
+            self.state = 'head'
+            self.ended = True
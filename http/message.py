@@ -3,27 +3,30 @@ class Message:
     Contains a dpkt.http.Request/Response, as well as other data required to
     build a HAR, including (mostly) start and end time.
 
-    * msg: underlying dpkt class
+    * msg: underlying http.parser.Request/Response
     * data_consumed: how many bytes of input were consumed
     * seq_start: first sequence number of the Message's data in the tcpdir
     * seq_end: first sequence number past Message's data (slice-style indices)
     * ts_start: when Message started arriving (dpkt timestamp)
     * ts_end: when Message had fully arrived (dpkt timestamp)
     * body_raw: body before compression is taken into account
-    * tcpdir: The tcp.Direction corresponding to the HTTP message
     '''
     def __init__(self, tcpdir, pointer, msgclass):
         '''
         Args:
         tcpdir = tcp.Direction
         pointer = position within tcpdir.data to start parsing from. byte index
-        msgclass = dpkt.http.Request/Response
+        msgclass = http.parser.Request/Response
         '''
-        self.tcpdir = tcpdir
-        # attempt to parse as http. let exception fall out to caller
-        self.msg = msgclass(tcpdir.data[pointer:])
-        self.data = self.msg.data
-        self.data_consumed = (len(tcpdir.data) - pointer) - len(self.data)
+        # tcpdir is not kept, so the flow's data can be freed once it has been
+        # parsed
+        skips = None
+        if tcpdir.skip_offsets:
+            # bodies were cut short during reassembly
+            skips = (tcpdir.skip_offsets, tcpdir.skip_totals)
+        # attempt to parse as http, in place. let exception fall out to caller
+        self.msg = msgclass(tcpdir.data, pointer, skips)
+        self.data_consumed = self.msg.end - pointer
         # calculate sequence numbers of data
         self.seq_start = tcpdir.byte_to_seq(pointer)
         self.seq_end = tcpdir.byte_to_seq(pointer + self.data_consumed) # past-the-end
@@ -0,0 +1,325 @@
+'''
+HTTP/1.x message parser that works on offsets into a buffer.
+
+Each message is parsed where it is in the buffer, which may be a string or an
+mmap, and nothing past it is copied: the headers are found with one search
+for the blank line that ends them and split all at once, and the body is
+located by offsets before it is sliced out. A body is framed by
+transfer-encoding: chunked, or content-length, or, in a response, by the end
+of the stream, as when the server closes the connection after it. Requests
+without either, and responses that can't have one (1xx, 204 and 304) have an
+empty body.
+
+Bytes may have been left out of the buffer while it was reassembled (see
+http.framing.BodySkipper). skips then says where, and bodies are framed as if
+they were there. body_size counts them, but body only has what was kept.
+
+Errors are dpkt.UnpackError's, or dpkt.NeedData if the buffer ends before
+the message does.
+'''
+
+import bisect
+import re
+import dpkt
+
+REQUEST_METHODS = dict.fromkeys((
+    'GET', 'PUT', 'ICY',
+    'COPY', 'HEAD', 'LOCK', 'MOVE', 'POLL', 'POST',
+    'BCOPY', 'BMOVE', 'MKCOL', 'TRACE', 'LABEL', 'MERGE',
+    'DELETE', 'SEARCH', 'UNLOCK', 'REPORT', 'UPDATE', 'NOTIFY',
+    'BDELETE', 'CONNECT', 'OPTIONS', 'CHECKIN',
+    'PROPFIND', 'CHECKOUT', 'CCM_POST',
+    'SUBSCRIBE', 'PROPPATCH', 'BPROPFIND',
+    'BPROPPATCH', 'UNCHECKOUT', 'MKACTIVITY',
+    'MKWORKSPACE', 'UNSUBSCRIBE', 'RPC_CONNECT',
+    'VERSION-CONTROL',
+    'BASELINE-CONTROL'
+    ))
+
+# a line with nothing but whitespace, which ends the headers
+BLANK_LINE = re.compile(r'\n[^\S\n]*\n')
+
+def parse_request_line(line):
+    '''
+    Returns (method, uri, version) from a request line. Raises
+    dpkt.UnpackError.
+    '''
+    l = line.split()
+    if len(l) != 3 or l[0] not in REQUEST_METHODS or \
+       not l[2].startswith('HTTP'):
+        raise dpkt.UnpackError('invalid request: %r' % line)
+    return l[0], l[1], l[2][5:]
+
+def parse_status_line(line):
+    '''
+    Returns (version, status, reason) from a status line. Raises
+    dpkt.UnpackError.
+    '''
+    l = line.strip().split(None, 2)
+    if len(l) < 2 or not l[0].startswith('HTTP') or not l[1].isdigit():
+        raise dpkt.UnpackError('invalid response: %r' % line)
+    return l[0][5:], l[1], l[2] if len(l) > 2 else ''
+
+def parse_headers(block):
+    '''
+    Returns {lowercase name: value} from the header lines in block. Values of
+    repeated headers are joined with commas. Raises dpkt.UnpackError.
+    '''
+    d = {}
+    for line in block.split('\n'):
+        l = line.split(None, 1)
+        if not l:
+            continue
+        if not l[0].endswith(':'):
+            raise dpkt.UnpackError('invalid header: %r' % line.strip())
+        k = l[0][:-1].lower()
+        v = l[1].strip() if len(l) != 1 else ''
+        if k in d:
+            d[k] += ',' + v
+        else:
+            d[k] = v
+    return d
+
+def body_framing(headers, status=None):
+    '''
+    Returns how the body of a message is framed: ('chunked', None),
+    ('length', n), ('close', None) for a response body that goes on to the
+    end of the stream, or ('none', None).
+
+    Args:
+    headers = {lowercase name: value}
+    status = string status code of a response, or None for a request
+    '''
+    if status is not None and (status[0] == '1' or status in ('204', '304')):
+        return 'none', None
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        return 'chunked', None
+    if 'content-length' in headers:
+        try:
+            n = int(headers['content-length'])
+        except ValueError:
+            raise dpkt.UnpackError('invalid content-length: %r' %
+                                   headers['content-length'])
+        if n < 0:
+            raise dpkt.UnpackError('invalid content-length: %d' % n)
+        return 'length', n
+    if status is not None:
+        return 'close', None
+    return 'none', None
+
+class Message(object):
+    '''
+    An HTTP message parsed out of a buffer.
+
+    Members:
+    * version = string, like '1.1'
+    * headers = {lowercase name: value}
+    * body = string, the body as it is in the buffer, de-chunked
+    * body_size = length of the whole body, including bytes that were skipped
+    * start, end = offsets of the message in the buffer, slice-style
+    '''
+    def __init__(self, buf, pos=0, skips=None):
+        '''
+        Args:
+        buf = string or mmap
+        pos = offset in buf where the message starts
+        skips = None, or (offsets, totals) saying where bytes were left out
+            of buf, like tcp.Direction.skip_offsets and skip_totals. Skips
+            at pos itself belong to whatever came before it.
+        '''
+        self.buf = buf
+        self.skips = skips
+        self.start = pos
+        eol = buf.find('\n', pos)
+        if eol < 0:
+            self.parse_start_line(buf[pos:])
+            raise dpkt.NeedData('premature end of headers')
+        self.parse_start_line(buf[pos:eol])
+        m = BLANK_LINE.search(buf, eol)
+        if not m:
+            raise dpkt.NeedData('premature end of headers')
+        self.headers = parse_headers(buf[eol+1:m.start()])
+        self.end = m.end()
+        self.parse_body()
+        # don't keep the buffer
+        del self.buf, self.skips
+
+    def parse_start_line(self, line):
+        raise NotImplementedError
+
+    def framing(self):
+        return body_framing(self.headers)
+
+    def parse_body(self):
+        '''
+        Sets body and body_size, and moves end past the body.
+        '''
+        framing, n = self.framing()
+        if framing == 'chunked':
+            self.parse_chunks()
+        elif framing == 'length':
+            start = self.end
+            self.end, self.body_size = self.read(start, n)
+            if self.body_size != n:
+                raise dpkt.NeedData('short body (missing %d bytes)' %
+                                    (n - self.body_size))
+            self.body = self.buf[start:self.end]
+        elif framing == 'close':
+            start = self.end
+            self.end, self.body_size = self.read(start, None)
+            self.body = self.buf[start:self.end]
+        else:
+            self.body = ''
+            self.body_size = 0
+
+    def parse_chunks(self):
+        buf = self.buf
+        pieces = []
+        self.body_size = 0
+        pos = self.end
+        while True:
+            eol = buf.find('\n', pos)
+            if eol < 0:
+                raise dpkt.NeedData('premature end of chunked body')
+            line = buf[pos:eol]
+            try:
+                n = int(line.split(None, 1)[0].split(';', 1)[0], 16)
+            except (IndexError, ValueError):
+                raise dpkt.UnpackError('invalid chunk size: %r' % line)
+            pos = eol + 1
+            if not n:
+                break
+            end, size = self.read(pos, n)
+            if size != n:
+                raise dpkt.NeedData('premature end of chunked body')
+            pieces.append(buf[pos:end])
+            self.body_size += n
+            eol = buf.find('\n', end)
+            if eol < 0:
+                raise dpkt.NeedData('premature end of chunked body')
+            if buf[end:eol].strip():
+                raise dpkt.UnpackError('missing end of chunk')
+            pos = eol + 1
+        # skip the trailer, up to and including an empty line
+        while True:
+            eol = buf.find('\n', pos)
+            if eol < 0:
+                # the end of the stream will do
+                pos = len(buf)
+                break
+            line = buf[pos:eol]
+            pos = eol + 1
+            if not line.strip():
+                break
+        self.end = pos
+        self.body = ''.join(pieces)
+
+    def read(self, pos, n):
+        '''
+        Reads n bytes of the stream from pos on, or all of them if n is None,
+        counting skipped bytes too. Returns (end, size), where they end in
+        buf, and how many there were.
+        '''
+        length = len(self.buf)
+        if not self.skips:
+            end = length if n is None else min(pos + n, length)
+            return end, end - pos
+        offsets, totals = self.skips
+        i = bisect.bisect_left(offsets, pos)
+        if n is None:
+            skipped = totals[-1] - (totals[i-1] if i else 0)
+            return length, length - pos + skipped
+        size = 0
+        while size < n:
+            if i < len(offsets) and offsets[i] == pos:
+                skip = totals[i] - (totals[i-1] if i else 0)
+                size += min(skip, n - size)
+                i += 1
+                continue
+            stop = offsets[i] if i < len(offsets) else length
+            step = min(stop - pos, n - size)
+            if step <= 0:
+                break
+            pos += step
+            size += step
+        return pos, size
+
+class Request(Message):
+    '''
+    An HTTP request. Also has method and uri.
+    '''
+    def parse_start_line(self, line):
+        self.method, self.uri, self.version = parse_request_line(line)
+
+class Response(Message):
+    '''
+    An HTTP response. Also has status and reason.
+    '''
+    def parse_start_line(self, line):
+        self.version, self.status, self.reason = parse_status_line(line)
+
+    def framing(self):
+        return body_framing(self.headers, self.status)
+
+if __name__ == '__main__':
+    import unittest
+
+    class TestParser(unittest.TestCase):
+        def test_request(self):
+            s = ('junk'
+                 'POST /main/redirect/ab/1,295,,00.html HTTP/1.0\r\n'
+                 'Connection: Keep-Alive\r\n'
+                 'Host: ltd.snap.com\r\n'
+                 'Content-type: application/x-www-form-urlencoded\r\n'
+                 'Content-length: 61\r\n\r\n'
+                 'sn=em&mn=dtest4&pw=this+is+atest&fr=true&login=Sign+in&od=www'
+                 'GET / HTTP/1.1\r\n\r\n')
+            r = Request(s, 4)
+            self.assertEqual(r.method, 'POST')
+            self.assertEqual(r.uri, '/main/redirect/ab/1,295,,00.html')
+            self.assertEqual(r.version, '1.0')
+            self.assertEqual(r.body, 'sn=em&mn=dtest4&pw=this+is+atest&'
+                                     'fr=true&login=Sign+in&od=www')
+            self.assertEqual(r.headers['content-type'],
+                             'application/x-www-form-urlencoded')
+            r = Request(s, r.end)
+            self.assertEqual((r.method, r.body, r.end), ('GET', '', len(s)))
+            self.assertRaises(dpkt.NeedData, Request, s[:100], 4)
+            self.assertRaises(dpkt.UnpackError, Request, s)
+
+        def test_chunked_response(self):
+            s = ('HTTP/1.1 200 OK\r\n'
+                 'Set-Cookie: a=1\r\n'
+                 'Transfer-Encoding: chunked\r\n'
+                 'Set-Cookie: b=2\r\n\r\n'
+                 'a;ext=1\r\n0123456789\r\n3\r\nabc\r\n0\r\nTrailer: x\r\n\r\n'
+                 'HTTP/1.1 304 Not Modified\r\nContent-Length: 10\r\n\r\n')
+            r = Response(s)
+            self.assertEqual((r.version, r.status, r.reason),
+                             ('1.1', '200', 'OK'))
+            self.assertEqual(r.headers['set-cookie'], 'a=1,b=2')
+            self.assertEqual((r.body, r.body_size), ('0123456789abc', 13))
+            r = Response(s, r.end)
+            self.assertEqual((r.status, r.body, r.end), ('304', '', len(s)))
+            self.assertRaises(dpkt.NeedData, Response, s[:90])
+
+        def test_close_delimited_response(self):
+            s = 'HTTP/1.0 200 OK\r\nServer: x\r\n\r\nall of the rest'
+            r = Response(s)
+            self.assertEqual((r.body, r.end), ('all of the rest', len(s)))
+
+        def test_skips(self):
+            # 10 byte body with bytes 2-9 skipped, then an 8 byte chunk with
+            # all 8 skipped
+            s = ('HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\n01'
+                 'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                 '8\r\n\r\n0\r\n\r\n')
+            second = s.index('HTTP', 1)
+            chunk = s.index('8\r\n') + 3
+            skips = ([second, chunk], [8, 16])
+            r = Response(s, 0, skips)
+            self.assertEqual((r.body, r.body_size, r.end), ('01', 10, second))
+            r = Response(s, r.end, skips)
+            self.assertEqual((r.body, r.body_size, r.end), ('', 8, len(s)))
+
+    unittest.main()
@@ -1,8 +1,8 @@
 import gzip
 import zlib
 import cStringIO
-import dpkt_http_replacement as dpkt_http
 import http
+import parser
 from mediatype import MediaType
 import logging as log
 #from http import DecodingError # exception class from parent module
@@ -20,39 +20,76 @@ class Response(http.Message):
     Members:
     * mediaType: mediatype.MediaType, constructed from content-type
     * mimeType: string mime type of returned data
-    * body: http decoded body data, otherwise unmodified
-    * text: body text, unicoded if possible, or None if the body is not text
+    * body: http decoded body data, otherwise unmodified. Decoded the first
+      time it is used, and kept until drop_content() is called.
+    * text: body text, unicoded if possible, or None if the body is not text.
+      Worked out from body the first time it is used, like body.
     * compression: string, compression type
-    * original_encoding: string, original text encoding/charset/whatever
+    * originalEncoding: string, original text encoding/charset/whatever, set
+      once text has been worked out
+    * truncated: bool, whether the body was cut short (see settings.body_cap),
+      in which case body is the start of the raw body and text is None
+    * undecodable: bool, whether decoding the body failed, in which case body
+      is the raw body and text is None. Only known once body has been used.
     '''
     def __init__(self, tcpdir, pointer):
-        http.Message.__init__(self, tcpdir, pointer, dpkt_http.Response)
-        # uncompress body if necessary
-        self.handle_compression()
+        http.Message.__init__(self, tcpdir, pointer, parser.Response)
+        self.truncated = self.msg.body_size > len(self.raw_body)
+        self.compression = self.msg.headers.get('content-encoding',
+                                                'identity').lower()
+        self.undecodable = False
         # get mime type
         if 'content-type' in self.msg.headers:
             self.mediaType = MediaType(self.msg.headers['content-type'])
         else:
             self.mediaType = MediaType('application/x-unknown-content-type')
         self.mimeType = self.mediaType.mimeType()
-        # try to get out unicode
-        self.handle_text()
+        self.drop_content()
+    @property
+    def body(self):
+        if self._body is None:
+            if self.truncated:
+                # the start of a compressed body can't be relied on to
+                # decompress
+                self._body = self.raw_body
+            else:
+                try:
+                    self._body = self.handle_compression()
+                except http.DecodingError as error:
+                    log.warning('%s, keeping the body as it is' % error)
+                    self.undecodable = True
+                    self._body = self.raw_body
+        return self._body
+    @property
+    def text(self):
+        if self._text is False:
+            body = self.body
+            if self.truncated or self.undecodable:
+                self._text = None
+            else:
+                self._text = self.handle_text(body)
+        return self._text
+    def drop_content(self):
+        '''
+        Forgets body and text, if they have been worked out, to save memory.
+        They are worked out again if they are used again.
+        '''
+        self._body = None
+        self._text = False # None is a valid text
     def handle_compression(self):
         '''
-        Sets self.body to the http decoded response data. Sets compression to
-        the name of the compresson type.
+        Returns the http decoded response data. Raises http.DecodingError.
         '''
         # if content-encoding is found
         if 'content-encoding' in self.msg.headers:
-            encoding = self.msg.headers['content-encoding'].lower()
-            self.compression = encoding
+            encoding = self.compression
             # handle gzip
             if encoding == 'gzip' or encoding == 'x-gzip':
                 try:
                     gzipfile = gzip.GzipFile(
                         fileobj = cStringIO.StringIO(self.raw_body)
                     )
-                    self.body = gzipfile.read()
+                    return gzipfile.read()
                 except zlib.error:
                     raise http.DecodingError('zlib failed to gunzip HTTP data')
                 except:
@@ -64,32 +101,29 @@ class Response(http.Message):
                     # NOTE: wbits = -15 is a undocumented feature in python (it's
                     # documented in zlib) that gets rid of the header so we can
                     # do raw deflate. See: http://bugs.python.org/issue5784
-                    self.body = zlib.decompress(self.raw_body, -15)
+                    return zlib.decompress(self.raw_body, -15)
                 except zlib.error:
                     raise http.DecodingError('zlib failed to undeflate HTTP data')
             elif encoding == 'compress' or encoding == 'x-compress':
                 # apparently nobody uses this, so basically just ignore it
-                self.body = self.raw_body
+                return self.raw_body
             elif encoding == 'identity':
                 # no compression
-                self.body = self.raw_body
+                return self.raw_body
             else:
                 # I'm pretty sure the above are the only allowed encoding types
                 # see RFC 2616 sec 3.5 (http://www.w3.org/Protocols/rfc2616/rfc2616-sec3.html#sec3.5)
                 raise http.DecodingError('unknown content-encoding token: ' + encoding)
         else:
             # no compression
-            self.compression = 'identity'
-            self.body = self.raw_body
-
-    def handle_text(self):
+            return self.raw_body
+    def handle_text(self, body):
         '''
         Takes care of converting body text to unicode, if its text at all.
-        Sets self.original_encoding to original char encoding, and converts body
-        to unicode if possible. Must come after handle_compression, and after
-        self.mediaType is valid.
+        Sets self.originalEncoding to original char encoding, and returns body,
+        the output of handle_compression, as unicode if possible, or None.
         '''
-        self.text = None
+        text = None
         # if the body is text
         if (self.mediaType and
             (self.mediaType.type == 'text' or
@@ -101,15 +135,15 @@ class Response(http.Message):
             else:
                 override_encodings = []
             # if there even is data (otherwise, dammit.originalEncoding might be None)
-            if self.body != '':
+            if body != '':
                 if UnicodeDammit:
                     # honestly, I don't mind not abiding by RFC 2023. UnicodeDammit just
                     # does what makes sense, and if the content is remotely standards-
                     # compliant, it will do the right thing.
-                    dammit = UnicodeDammit(self.body, override_encodings)
+                    dammit = UnicodeDammit(body, override_encodings)
                     # if unicode was found
                     if dammit.unicode:
-                        self.text = dammit.unicode
+                        text = dammit.unicode
                         self.originalEncoding = dammit.originalEncoding
                     else:
                         # unicode could not be decoded, at all
@@ -121,7 +155,7 @@ class Response(http.Message):
                     # try our list of encodings + utf8 with strict errors
                     for e in override_encodings + ['utf8', 'iso-8859-1']:
                         try:
-                            u = self.body.decode(e, 'strict')
+                            u = body.decode(e, 'strict')
                             self.originalEncoding = e
                             break # if ^^ didn't throw, we're done
                         except UnicodeError:
@@ -129,9 +163,10 @@ class Response(http.Message):
                     # if none of those worked, try utf8 with 'replace' error mode
                     if not u:
                         # unicode has failed
-                        u = self.body.decode('utf8', 'replace')
+                        u = body.decode('utf8', 'replace')
                         self.originalEncoding = None # ???
-                    self.text = u or None
+                    text = u or None
         else:
             # body is not text
-            self.text = None
+            text = None
+        return text
@@ -0,0 +1,55 @@
+'''
+Tells HTTP streams from other TCP traffic by their first few bytes, so that
+the data of connections that can't be HTTP doesn't have to be kept until they
+finish (see tcp.Flow.sniffer), and requests from responses, so that each
+direction of a flow is only parsed once (see http.Flow).
+'''
+
+import dpkt
+from parser import REQUEST_METHODS, parse_request_line, parse_status_line
+
+# longest first word worth looking at
+MAX_WORD = max(len(m) for m in REQUEST_METHODS)
+# how many bytes to look at, leading whitespace included
+SNIFF_BYTES = 64
+# longest start line worth looking for the end of
+MAX_START_LINE = 8 * 1024
+
+def looks_like_http(data):
+    '''
+    Whether data, the first payload bytes of one direction of a TCP stream,
+    could be the start of an HTTP request or response: a request method
+    followed by whitespace, or HTTP. If data is too short to tell, it counts
+    as HTTP.
+    '''
+    # data may be a buffer, whose slices are strings
+    data = data[:SNIFF_BYTES].lstrip()[:MAX_WORD+1]
+    if data.startswith('HTTP'):
+        return True
+    words = data.split(None, 1)
+    word = words[0] if words else ''
+    if len(word) < len(data):
+        # the word is complete
+        return word in REQUEST_METHODS
+    return ('HTTP'.startswith(word) or
+            any(m.startswith(word) for m in REQUEST_METHODS))
+
+def start_line_kind(data):
+    '''
+    Returns 'request' or 'response', depending on which kind of message the
+    first line of data starts, or None if it is neither.
+    '''
+    if not data:
+        return None
+    eol = data.find('\n', 0, MAX_START_LINE)
+    line = data[:eol] if eol >= 0 else data[:MAX_START_LINE]
+    try:
+        parse_request_line(line)
+        return 'request'
+    except dpkt.UnpackError:
+        pass
+    try:
+        parse_status_line(line)
+        return 'response'
+    except dpkt.UnpackError:
+        return None
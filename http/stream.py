@@ -0,0 +1,221 @@
+'''
+Parses HTTP out of TCP flows while their packets are still being added, so
+that each message is parsed as soon as it has arrived, and its data freed,
+instead of holding whole flows until they finish.
+'''
+
+import logging
+from collections import deque
+import dpkt
+from http import Request, Response
+from flow import MessagePair
+from framing import BodySkipper
+from sniff import start_line_kind
+
+class MessageStream(object):
+    '''
+    Parses the messages of one tcp.Direction as soon as they are complete,
+    and releases their data from it. It is the direction's consumer, and
+    gives it a framing.BodySkipper as its skipper, which notes where the
+    messages end as the data becomes contiguous, so that it isn't parsed
+    before then.
+
+    Parsing stops at the first message that fails, as in
+    http.flow.gather_messages. What is left when the direction finishes is
+    parsed then, like the body of a response that lasts until the connection
+    closes.
+
+    Members:
+    * framer = http.framing.BodySkipper
+    * callback = callable(http.Request or http.Response)
+    * count = number of messages parsed
+    * failed = bool, whether parsing has stopped at a bad message
+    '''
+    def __init__(self, tcpdir, callback, cap=None):
+        '''
+        Args:
+        tcpdir = tcp.Direction, before any data has been added to it
+        callback = called with each message
+        cap = see framing.BodySkipper
+        '''
+        self.framer = BodySkipper(cap)
+        self.callback = callback
+        self.count = 0
+        self.failed = False
+        tcpdir.skipper = self.framer
+        tcpdir.consumer = self
+
+    def feed(self, tcpdir):
+        ends = self.framer.ends
+        if not ends or self.failed:
+            return
+        # parse as far as the last message known to be complete
+        end = ends[-1] - tcpdir.released
+        del ends[:]
+        self.parse(tcpdir, end)
+
+    def finish(self, tcpdir):
+        if tcpdir.data:
+            self.parse(tcpdir, len(tcpdir.data), True)
+
+    def parse(self, tcpdir, end, finished=False):
+        '''
+        Parses messages from the start of tcpdir.data up to end, and releases
+        them.
+        '''
+        kind = self.framer.kind
+        if kind is None:
+            kind = start_line_kind(tcpdir.data)
+        msgclass = Request if kind == 'request' else Response
+        pointer = 0
+        while pointer < end and not self.failed:
+            try:
+                msg = msgclass(tcpdir, pointer)
+            except dpkt.NeedData as error:
+                if not finished:
+                    # the rest isn't there yet
+                    break
+                self.stop(error)
+            except dpkt.Error as error:
+                self.stop(error)
+            else:
+                pointer += msg.data_consumed
+                self.count += 1
+                self.callback(msg)
+        if finished:
+            pointer = len(tcpdir.data)
+        if pointer:
+            tcpdir.release(pointer)
+
+    def stop(self, error):
+        if self.count:
+            logging.warning("We got a dpkt.Error %s, but we are done." % error)
+        self.failed = True
+
+class FlowParser(object):
+    '''
+    Parses the HTTP in a tcp.Flow as its packets are added, with a
+    MessageStream on each direction, and passes each request/response pair
+    on as soon as both have been parsed. Messages are paired up the same way
+    as in http.Flow.
+
+    Members:
+    * tcpflow = tcp.Flow, or None once finished
+    * callback = callable(MessagePair)
+    * pairs = [MessagePair], the pairs passed on so far
+    * streams = (MessageStream, MessageStream), for fwd and rev, or None
+      once finished
+    * ts_connect = when the handshake started, or None if there was none.
+      Set by finish.
+    '''
+    def __init__(self, tcpflow, callback, cap=None):
+        '''
+        Args:
+        tcpflow = tcp.Flow, before any packets have been added to it
+        callback = called with each MessagePair
+        cap = bytes of each body to keep, or None to keep them all
+        '''
+        self.tcpflow = tcpflow
+        self.callback = callback
+        self.pairs = []
+        self.requests = deque()
+        self.responses = deque()
+        self.first_request_ts = None
+        self.started = False # whether a response after the first request
+                             # has turned up, so pairing can start
+        self.connected = False
+        self.ts_connect = None
+        self.streams = (MessageStream(tcpflow.fwd, self.add_message, cap),
+                        MessageStream(tcpflow.rev, self.add_message, cap))
+
+    def add_message(self, msg):
+        if isinstance(msg, Request):
+            if self.first_request_ts is None:
+                self.first_request_ts = msg.ts_start
+            self.requests.append(msg)
+        else:
+            self.responses.append(msg)
+        self.pair()
+
+    def pair(self):
+        if not self.started:
+            if self.first_request_ts is None:
+                return
+            if not any(response.ts_start > self.first_request_ts
+                       for response in self.responses):
+                return
+            self.started = True
+        while self.requests and self.responses:
+            req = self.requests.popleft()
+            resp = self.responses.popleft()
+            if not self.connected and self.tcpflow.handshake:
+                req.ts_connect = self.tcpflow.handshake[0].ts
+                self.connected = True
+            else:
+                req.ts_connect = req.ts_start
+            pair = MessagePair(req, resp)
+            self.pairs.append(pair)
+            self.callback(pair)
+
+    def finish(self):
+        '''
+        Called once the tcp.Flow has finished, so all the messages that will
+        be parsed have been. Lets go of the tcp.Flow and anything else the
+        HAR doesn't need, so that they can be freed while the rest of the
+        capture is read.
+        '''
+        if not any(stream.count for stream in self.streams):
+            logging.warning('TCP Flow does not contain HTTP')
+        elif self.requests and not self.started:
+            logging.warning("Request has no reponse.")
+        if self.tcpflow.handshake:
+            self.ts_connect = self.tcpflow.handshake[0].ts
+        self.tcpflow = None
+        self.streams = None
+        self.requests.clear()
+        self.responses.clear()
+
+if __name__ == '__main__':
+    # run from the top directory with python -m http.stream
+    import gc
+    import unittest
+    import weakref
+    import tcp
+    from dpkt.tcp import TH_SYN, TH_ACK, TH_FIN
+
+    CLIENT = ('\x0a\x00\x00\x01', 40000)
+    SERVER = ('\x0a\x00\x00\x02', 80)
+
+    class TestFlowParser(unittest.TestCase):
+        def test_finished_flow_is_freed(self):
+            tcpflow = tcp.Flow()
+            pairs = []
+            parser = FlowParser(tcpflow, pairs.append)
+            request = 'GET / HTTP/1.1\r\nHost: x\r\n\r\n'
+            response = 'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nhi'
+            c, s = (CLIENT, SERVER), (SERVER, CLIENT)
+            for pkt in [
+                tcp.Packet(1.0, c, 99, 0, TH_SYN, ''),
+                tcp.Packet(1.1, s, 499, 100, TH_SYN | TH_ACK, ''),
+                tcp.Packet(1.2, c, 100, 500, TH_ACK, ''),
+                tcp.Packet(1.3, c, 100, 500, TH_ACK, request),
+                tcp.Packet(1.4, s, 500, 100 + len(request), TH_ACK, response),
+                tcp.Packet(1.5, c, 100 + len(request), 500 + len(response),
+                           TH_FIN | TH_ACK, ''),
+                tcp.Packet(1.6, s, 500 + len(response), 101 + len(request),
+                           TH_FIN | TH_ACK, ''),
+                ]:
+                tcpflow.add(pkt)
+            tcpflow.finish()
+            parser.finish()
+            self.assertEqual(len(pairs), 1)
+            self.assertEqual(pairs[0].request.ts_connect, 1.0)
+            self.assertEqual(pairs[0].response.body, 'hi')
+            self.assertEqual(parser.ts_connect, 1.0)
+            # the parser is kept for the HAR, but the tcp.Flow isn't
+            ref = weakref.ref(tcpflow)
+            del tcpflow
+            gc.collect()
+            self.assertTrue(ref() is None)
+
+    unittest.main()
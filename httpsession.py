@@ -6,6 +6,7 @@ HAR file.
 from datetime import datetime
 from pcaputil import ms_from_timedelta, ms_from_dpkt_time
 from pagetracker import PageTracker
+import dpkt
 import http
 import logging as log
 import settings
@@ -114,49 +115,94 @@ class HttpSession(object):
     '''
     Represents all http traffic from within a pcap.
 
+    Flows can be passed in one at a time with add_flow, as they are finished,
+    followed by a call to finish(); or all at once, by passing a finished
+    PacketDispatcher that was made without a flow_callback to the
+    constructor. If start_flow is also called with each flow as it starts,
+    and settings.stream_http is set, its HTTP is parsed, and its entries
+    made, while its packets are still being added.
+
     Members:
     * user_agents = UserAgentTracker
     * user_agent = most-used user-agent in the flow
-    * flows = [http.Flow]
+    * flows = [http.Flow or http.FlowParser]
     * entries = [Entry], all http request/response pairs
+    * parsers = {tcp.Flow: http.FlowParser}, for the flows being parsed as
+      they go
     '''
-    def __init__(self, packetdispatcher):
+    def __init__(self, packetdispatcher=None):
         '''
         parses http.flows from packetdispatcher, and parses those for HAR info
         '''
-        # parse http flows
-        self.flows= []
-        for flow in packetdispatcher.tcp.flowdict.itervalues():
-            try:
-                self.flows.append(http.Flow(flow))
-            except http.Error as error:
-                log.warning(error)
-            except dpkt.dpkt.Error as error:
-                log.warning(error)
-        # combine the messages into a list
-        pairs = reduce(lambda p, f: p+f.pairs, self.flows, [])
+        self.flows = []
+        self.entries = []
+        self.parsers = {}
+        if packetdispatcher:
+            for flow in packetdispatcher.tcp.finished_flows:
+                self.add_flow(flow)
+            self.finish(packetdispatcher)
+    def start_flow(self, tcpflow):
+        '''
+        Starts parsing a new tcp.Flow as HTTP as its packets are added, if
+        settings.stream_http is set. Can be used as a tcp.FlowBuilder
+        start_callback.
+        '''
+        if settings.stream_http:
+            self.parsers[tcpflow] = http.FlowParser(tcpflow, self.add_pair,
+                                                    settings.body_cap)
+    def add_pair(self, pair):
+        self.entries.append(Entry(pair.request, pair.response))
+    def add_flow(self, tcpflow):
+        '''
+        Parses a finished tcp.Flow as HTTP, and makes entries of its messages,
+        unless that was done as it went. Can be used as a tcp.FlowBuilder
+        flow_callback.
+        '''
+        parser = self.parsers.pop(tcpflow, None)
+        if tcpflow.ignored:
+            return
+        if parser:
+            parser.finish()
+            if parser.pairs:
+                self.flows.append(parser)
+            return
+        try:
+            flow = http.Flow(tcpflow)
+        except http.Error as error:
+            log.warning(error)
+            return
+        except dpkt.dpkt.Error as error:
+            log.warning(error)
+            return
+        self.flows.append(flow)
+        for msg in flow.pairs:
+            self.entries.append(Entry(msg.request, msg.response))
+    def finish(self, packetdispatcher):
+        '''
+        Called once all flows have been added. Works out pages, the user agent
+        and DNS timings, which need all the entries.
+
+        Args:
+        packetdispatcher = PacketDispatcher, for its DNS queries
+        '''
         # set-up
         self.user_agents = UserAgentTracker()
         if settings.process_pages:
             self.page_tracker = PageTracker()
         else:
             self.page_tracker = None
-        self.entries = []
-        # sort pairs on request.ts_connect
-        pairs.sort(
-            key=lambda pair: pair.request.ts_connect
+        # sort entries on request.ts_connect
+        self.entries.sort(
+            key=lambda entry: entry.request.ts_connect
         )
         # iter through messages and do important stuff
-        for msg in pairs:
-            entry = Entry(msg.request, msg.response)
-            # if msg.request has a user-agent, add it to our list
-            if 'user-agent' in msg.request.msg.headers:
-                self.user_agents.add(msg.request.msg.headers['user-agent'])
-            # if msg.request has a referer, keep track of that, too
+        for entry in self.entries:
+            # if the request has a user-agent, add it to our list
+            if 'user-agent' in entry.request.msg.headers:
+                self.user_agents.add(entry.request.msg.headers['user-agent'])
+            # if the request has a referer, keep track of that, too
             if self.page_tracker:
                 entry.pageref = self.page_tracker.getref(entry)
-            # add it to the list
-            self.entries.append(entry)
         self.user_agent = self.user_agents.dominant_user_agent()
         # handle DNS AFTER sorting
         # this algo depends on first appearance of a name
@@ -0,0 +1,53 @@
+'''
+Finding the network layer header in captured frames, for code that reads
+raw frames without dpkt.
+
+A locator takes a frame and returns (offset of the network header, 4, 6 or
+None), the last being the IP version, or None for anything but IP. Locators
+raise struct.error or IndexError if the frame is too short.
+'''
+
+import struct
+
+unpack_short = struct.Struct('>H').unpack_from
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_IP6 = 0x86dd
+ETH_TYPE_VLANS = (0x8100, 0x88a8, 0x9100)
+
+def ethertype_family(ethertype):
+    if ethertype == ETH_TYPE_IP:
+        return 4
+    elif ethertype == ETH_TYPE_IP6:
+        return 6
+    return None
+
+def locate_ethernet(buf):
+    ethertype, = unpack_short(buf, 12)
+    off = 14
+    while ethertype in ETH_TYPE_VLANS:
+        ethertype, = unpack_short(buf, off + 2)
+        off += 4
+    return off, ethertype_family(ethertype)
+
+def locate_sll(buf):
+    return 16, ethertype_family(unpack_short(buf, 14)[0])
+
+def locate_raw(buf, off=0):
+    version = ord(buf[off]) >> 4
+    return off, version if version in (4, 6) else None
+
+def locate_null(buf):
+    # 4 byte address family in host byte order; the IP version is simpler
+    return locate_raw(buf, 4)
+
+# DLT_* values
+LOCATORS = {
+    0: locate_null, # DLT_NULL
+    1: locate_ethernet, # DLT_EN10MB
+    12: locate_raw, # DLT_RAW on most platforms
+    14: locate_raw, # DLT_RAW on OpenBSD
+    101: locate_raw, # LINKTYPE_RAW
+    108: locate_null, # DLT_LOOP
+    113: locate_sll, # DLT_LINUX_SLL
+}
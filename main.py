@@ -15,40 +15,152 @@ import har
 import json
 import tcp
 import settings
+import capfilter
+import flowindex
+import socket
 from packetdispatcher import PacketDispatcher
 
+def parse_size(text):
+    '''
+    Parses a size in bytes, like 1000000, 512K, 100M or 2G. Raises
+    ValueError.
+    '''
+    units = {'K': 1<<10, 'M': 1<<20, 'G': 1<<30}
+    text = text.strip().upper().rstrip('B')
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
 # get cmdline args/options
 parser = optparse.OptionParser(
-    usage='usage: %prog inputfile outputfile'
+    usage='usage: %prog inputfile outputfile\n'
+          '       %prog -o outputfile inputfile...\n\n'
+          'Use - as inputfile to read the capture from stdin. Several input '
+          'files are merged in timestamp order.'
 )
 parser.add_option('--no-pages', action="store_false", dest="pages", default=True)
+parser.add_option('--keep-packets', action='store_true', dest='keep_packets',
+                  default=False,
+                  help='keep every packet of each TCP flow in memory, for '
+                  'debugging')
+parser.add_option('-o', '--output', dest='output', default=None,
+                  help='write the HAR to this file; all arguments are inputs')
+parser.add_option('-f', '--filter', dest='filter', default=None,
+                  metavar='EXPR',
+                  help='only read packets matching this capture filter, e.g. '
+                  '"tcp port 80 and not host 10.0.0.1". See capfilter.py.')
+parser.add_option('--index', action='store_true', dest='index', default=False,
+                  help='use a flow index sidecar file, building it if needed')
+parser.add_option('--flow', action='append', dest='flows', default=[],
+                  metavar='HOST:PORT',
+                  help='only convert TCP flows with an endpoint matching '
+                  'HOST:PORT, HOST or :PORT. Implies --index. Repeatable.')
+parser.add_option('--idle-timeout', type='float', dest='idle_timeout',
+                  default=None, metavar='SECONDS',
+                  help='finish TCP flows that have had no packets for this '
+                  'long, instead of only when they close or the capture ends')
+parser.add_option('--max-flows', type='int', dest='max_flows', default=None,
+                  metavar='N',
+                  help='keep at most N TCP flows open, finishing the least '
+                  'recently used one when another starts')
+parser.add_option('--reorder-window', type='float', dest='reorder_window',
+                  default=settings.reorder_window, metavar='SECONDS',
+                  help='put TCP packets up to this far out of timestamp order '
+                  'back in order (default %default)')
+parser.add_option('--max-memory', dest='max_memory', default=None,
+                  metavar='SIZE',
+                  help='spill the TCP data of big flows to temporary files '
+                  'when open flows hold more than this, e.g. 512M or 2G')
+parser.add_option('--body-cap', dest='body_cap', default=None,
+                  metavar='SIZE',
+                  help='keep only the first SIZE bytes of each HTTP body, '
+                  'e.g. 0 or 4K. Sizes and timings are still right, but '
+                  'bodies cut short are left out of the HAR.')
+parser.add_option('--keep-non-http', action='store_false', dest='sniff_http',
+                  default=True,
+                  help="keep the data of TCP flows whose first bytes don't "
+                  'look like HTTP, instead of throwing it away')
+parser.add_option('--no-stream', action='store_false', dest='stream_http',
+                  default=True,
+                  help='parse the HTTP in each TCP flow once it has finished, '
+                  'instead of as its packets are read')
+parser.add_option('--no-content', action='store_false',
+                  dest='include_content', default=True,
+                  help="leave the content of responses out of the HAR. Bodies "
+                  "aren't kept at all, unless --body-cap is given.")
 options, args = parser.parse_args()
 
 # copy options to settings module
 settings.process_pages = options.pages
+settings.keep_tcp_packets = options.keep_packets
+settings.flow_idle_timeout = options.idle_timeout
+settings.max_tcp_flows = options.max_flows
+settings.reorder_window = options.reorder_window
+settings.sniff_http = options.sniff_http
+settings.stream_http = options.stream_http
+settings.include_content = options.include_content
+if options.max_memory:
+    try:
+        settings.max_memory = parse_size(options.max_memory)
+    except ValueError:
+        parser.error('invalid --max-memory: %s' % options.max_memory)
+if options.body_cap is not None:
+    try:
+        settings.body_cap = parse_size(options.body_cap)
+    except ValueError:
+        parser.error('invalid --body-cap: %s' % options.body_cap)
+elif not options.include_content:
+    # sizes and timings don't need the bodies
+    settings.body_cap = 0
 
 # setup logs
 logging.basicConfig(filename='pcap2har.log', level=logging.INFO)
 
 # get filenames, or bail out with usage error
-if len(args) == 2:
-    inputfile, outputfile = args[0:2]
-elif len(args) == 1:
-    inputfile = args[0]
-    outputfile = inputfile+'.har'
+if options.output and args:
+    inputfiles, outputfile = args, options.output
+elif len(args) == 2:
+    inputfiles, outputfile = args[0:1], args[1]
+elif len(args) == 1 and args[0] != '-':
+    inputfiles = args
+    outputfile = args[0]+'.har'
 else:
     parser.print_help()
     sys.exit()
 
-logging.info("Processing %s", inputfile)
+if (options.index or options.flows) and (
+        len(inputfiles) != 1 or inputfiles[0] == '-'):
+    parser.error('--index and --flow need a single capture file')
+try:
+    flow_specs = map(flowindex.parse_flow_spec, options.flows)
+except (ValueError, socket.error) as e:
+    parser.error('invalid --flow: %s' % e)
+if options.filter:
+    try:
+        capfilter.Filter(options.filter)
+    except capfilter.FilterError as e:
+        parser.error('invalid --filter: %s' % e)
+
+logging.info("Processing %s", ', '.join(inputfiles))
 
-# parse pcap file
-dispatcher = PacketDispatcher()
-pcap.ParsePcap(dispatcher, filename=inputfile)
+# parse pcap file(s). flows are parsed as HTTP as soon as they are finished
+session = httpsession.HttpSession()
+dispatcher = PacketDispatcher(session.add_flow, session.start_flow)
+if options.index or flow_specs:
+    reader = flowindex.indexed_reader(inputfiles[0], flow_specs)
+    if reader:
+        pcap.ParsePcap(dispatcher, reader=reader,
+                       capture_filter=options.filter)
+elif len(inputfiles) == 1:
+    pcap.ParsePcap(dispatcher, filename=inputfiles[0],
+                   capture_filter=options.filter)
+else:
+    pcap.ParsePcap(dispatcher, filenames=inputfiles,
+                   capture_filter=options.filter)
 dispatcher.finish()
 
 # parse HAR stuff
-session = httpsession.HttpSession(dispatcher)
+session.finish(dispatcher)
 
 logging.info("Flows=%d. HTTP pairs=%d" % (len(session.flows),len(session.entries)))
 
@@ -1,4 +1,8 @@
 import dpkt
+import http.framing
+import http.sniff
+import logging as log
+import settings
 import tcp
 import udp
 
@@ -11,11 +15,32 @@ class PacketDispatcher:
     objects for now.
 
     Members:
-    * flowbuilder = tcp.FlowBuilder
+    * tcp = tcp.FlowBuilder
+    * reorder = tcp.ReorderBuffer, which TCP packets go through on their way
+      to tcp, so that timestamps slightly out of order don't upset tcp.Flow
     * udp = udp.Processor
     '''
-    def __init__(self):
-        self.tcp = tcp.FlowBuilder()
+    def __init__(self, flow_callback=None, start_callback=None):
+        '''
+        flow_callback = passed to tcp.FlowBuilder, to be handed each tcp.Flow
+        as soon as it is finished. Without it, finished flows are collected in
+        self.tcp.finished_flows
+        start_callback = passed to tcp.FlowBuilder, to be handed each tcp.Flow
+        as it starts
+        '''
+        skipper_factory = None
+        if settings.body_cap is not None:
+            # keep only the start of HTTP bodies
+            skipper_factory = lambda: http.framing.BodySkipper(
+                settings.body_cap)
+        sniffer = None
+        if settings.sniff_http:
+            sniffer = http.sniff.looks_like_http
+        self.tcp = tcp.FlowBuilder(flow_callback,
+                                   skipper_factory=skipper_factory,
+                                   sniffer=sniffer,
+                                   start_callback=start_callback)
+        self.reorder = tcp.ReorderBuffer(self.tcp.add, settings.reorder_window)
         self.udp = udp.Processor()
     def add(self, ts, buf, eth):
         '''
@@ -30,11 +55,20 @@ class PacketDispatcher:
             ip = eth.data
             # if it's TCP
             if isinstance(ip.data, dpkt.tcp.TCP):
-                tcppkt = tcp.Packet(ts, buf, eth, ip, ip.data)
-                self.tcp.add(tcppkt)
+                tcppkt = tcp.Packet.from_dpkt(ts, ip, ip.data)
+                self.reorder.add(tcppkt)
             # if it's UDP...
             elif isinstance(ip.data, dpkt.udp.UDP):
                 self.udp.add(ts, ip.data)
+    def add_tcp(self, pkt):
+        '''
+        pkt = tcp.Packet, already decoded, e.g. by decoder.decode_tcp
+        '''
+        self.reorder.add(pkt)
     def finish(self):
-        #This is a hack, until tcp.Flow no longer has to be `finish()`ed
+        # finishes the flows that are still open
+        self.reorder.flush()
+        if self.reorder.late_count:
+            log.warning('%d TCP packets were more than %gs out of order' % (
+                self.reorder.late_count, self.reorder.window))
         self.tcp.finish()
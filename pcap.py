@@ -1,3 +1,4 @@
+import capfilter
 import dpkt
 from pcaputil import *
 from socket import inet_ntoa
@@ -6,35 +7,76 @@ import logging as log
 import os
 import shutil
 import tcp
+from decoder import decode_tcp
 from packetdispatcher import PacketDispatcher
 
 
-def ParsePcap(dispatcher, filename=None, reader=None):
+def parse_frame(buf, linktype):
     '''
-    Parses the passed pcap file or pcap reader.
+    Parses the link layer of a captured frame. Returns a dpkt.sll.SLL or
+    dpkt.ethernet.Ethernet; either way, .data is the network layer packet.
+    '''
+    # handle SLL packets, thanks Libo
+    if linktype == dpkt.pcap.DLT_LINUX_SLL:
+        return dpkt.sll.SLL(buf)
+    # otherwise, for now, assume Ethernet
+    else:
+        return dpkt.ethernet.Ethernet(buf)
+
+def open_file(filename):
+    '''
+    Opens a capture file and returns a reader for it, or None if it is not a
+    valid capture. '-' means stdin.
+    '''
+    if filename == '-':
+        f = open_stdin()
+    else:
+        f = open(filename, 'rb')
+    try:
+        return open_reader(f)
+    except dpkt.dpkt.Error as e:
+        log.warning('failed to parse pcap file %s' % filename)
+        return None
+
+def ParsePcap(dispatcher, filename=None, reader=None, filenames=None,
+              capture_filter=None):
+    '''
+    Parses the passed pcap file(s) or pcap reader.
 
     Adds the packets to the PacketDispatcher. Keeps a list
 
     Args:
     dispatcher = PacketDispatcher
-    reader = pcaputil.ModifiedReader or None
-    filename = filename of pcap file or None
+    reader = pcaputil.ModifiedReader, pcaputil.MmapReader, pcapng.Reader or
+        None
+    filename = filename of pcap file, '-' for stdin, or None
+    filenames = [filename] or None. The files are merged in timestamp order
+        with a pcaputil.MergedReader.
+    capture_filter = capfilter expression or None. Frames that don't match
+        are dropped before being parsed. Defaults to the reader's filter, as
+        set by its setfilter().
 
     check for filename first; if there is one, load the reader from that. if
-    not, look for reader.
+    not, look for filenames, then reader.
     '''
     if filename:
-        f = open(filename, 'rb')
-        try:
-            pcap = ModifiedReader(f)
-        except dpkt.dpkt.Error as e:
-            log.warning('failed to parse pcap file %s' % filename)
+        pcap = open_file(filename)
+        if not pcap:
+            return
+    elif filenames:
+        readers = filter(None, map(open_file, filenames))
+        if not readers:
             return
+        pcap = MergedReader(readers)
     elif reader:
         pcap = reader
     else:
         raise 'function ParsePcap needs either a filename or pcap reader'
     #now we have the reader; read from it
+    # pcapng packets carry the link type of their own interface
+    datalink = pcap.datalink()
+    capture_filter = capture_filter or getattr(pcap, 'filter', '')
+    match = capture_filter and capfilter.Filter(capture_filter).match
     packet_count = 1 # start from 1 like Wireshark
     errors = [] # store errors for later inspection
     try:
@@ -47,16 +89,20 @@ def ParsePcap(dispatcher, filename=None, reader=None):
                 # log packet number so user can diagnose issue in wireshark
                 log.warning('ParsePcap: discarding incomplete packet, # %d' % packet_count)
                 continue
+            linktype = getattr(hdr, 'linktype', datalink)
+            # skip filtered packets before paying for dpkt
+            if match and not match(buf, linktype):
+                packet_count += 1
+                continue
             # parse packet
             try:
-                # handle SLL packets, thanks Libo
-                dltoff = dpkt.pcap.dltoff
-                if pcap.dloff == dltoff[dpkt.pcap.DLT_LINUX_SLL]:
-                    eth = dpkt.sll.SLL(buf)
-                # otherwise, for now, assume Ethernet
+                # plain TCP skips dpkt entirely
+                pkt = decode_tcp(ts, buf, linktype)
+                if pkt:
+                    dispatcher.add_tcp(pkt)
                 else:
-                    eth = dpkt.ethernet.Ethernet(buf)
-                dispatcher.add(ts, buf, eth)
+                    eth = parse_frame(buf, linktype)
+                    dispatcher.add(ts, buf, eth)
             # catch errors from this packet
             except dpkt.Error as e:
                 errors.append((packet, e, packet_count))
@@ -66,6 +112,6 @@ def ParsePcap(dispatcher, filename=None, reader=None):
     except dpkt.dpkt.NeedData as error:
         log.warning(error)
         log.warning('A packet in the pcap file was too short, '
-                    'debug_pkt_count=%d' % debug_pkt_count)
+                    'debug_pkt_count=%d' % packet_count)
         errors.append((None, error))
     
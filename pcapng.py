@@ -0,0 +1,177 @@
+'''
+Streaming reader for pcapng capture files.
+
+Reads the file one block at a time, so it never holds more than a single
+packet in memory. Only the blocks that carry packets we can use are
+interpreted: Section Header, Interface Description, Enhanced Packet and the
+obsolete Packet block. Everything else is skipped.
+
+See http://www.winpcap.org/ntar/draft/PCAP-DumpFileFormat.html
+'''
+
+import struct
+import logging as log
+from readerbase import PktHdr, ReaderMixin
+
+# first four bytes of every pcapng file, the type of the Section Header Block
+MAGIC = '\x0a\x0d\x0d\x0a'
+BYTE_ORDER_MAGIC = 0x1a2b3c4d
+
+# block types
+BT_SHB = 0x0a0d0d0a
+BT_IDB = 0x00000001
+BT_PB = 0x00000002 # obsolete Packet Block
+BT_SPB = 0x00000003
+BT_EPB = 0x00000006
+
+# interface description block options
+OPT_ENDOFOPT = 0
+IF_TSRESOL = 9
+IF_TSOFFSET = 14
+
+class Interface(object):
+    '''
+    What we need to know about a capture interface to interpret its packets.
+
+    Members:
+    * linktype = int, DLT_* constant
+    * snaplen = int
+    * tsresol = number of timestamp units per second
+    * tsoffset = seconds to add to every timestamp
+    '''
+    def __init__(self, linktype, snaplen):
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.tsresol = 1000000
+        self.tsoffset = 0
+
+class Reader(ReaderMixin):
+    '''
+    Reads packets from a pcapng file object, yielding (ts, buf, hdr) tuples
+    like pcaputil.ModifiedReader. hdr is a readerbase.PktHdr, with
+    the link type of the packet's interface.
+
+    Multiple sections are handled; interface ids are local to a section, as
+    the format requires. Raises ValueError if the file does not start with a
+    Section Header Block.
+    '''
+
+    def __init__(self, fileobj):
+        self.name = getattr(fileobj, 'name', '<pcapng>')
+        self.__f = fileobj
+        self.interfaces = []
+        # parse the first SHB now, to fail early on non-pcapng input
+        blocktype, body = self.__read_block(first=True)
+        if blocktype != BT_SHB:
+            raise ValueError('invalid pcapng section header')
+        self.filter = ''
+
+    @property
+    def snaplen(self):
+        return self.interfaces[0].snaplen if self.interfaces else None
+
+    def datalink(self):
+        '''
+        link type of the first interface, or None if none has been read yet.
+        Per-packet link types are in hdr.linktype.
+        '''
+        return self.interfaces[0].linktype if self.interfaces else None
+
+    def __read_block(self, first=False):
+        '''
+        Reads one block. Returns (blocktype, body) where body excludes the type,
+        length and trailing length fields, or (None, None) at the end of the
+        file. A Section Header Block resets the byte order and interfaces.
+        '''
+        head = self.__f.read(8)
+        if len(head) < 8:
+            if head:
+                log.warning('pcapng: truncated block header in %s' % self.name)
+            return None, None
+        if head[:4] == MAGIC:
+            # new section. figure out byte order from the byte-order magic
+            bom = self.__f.read(4)
+            if len(bom) < 4:
+                log.warning('pcapng: truncated section header in %s' % self.name)
+                return None, None
+            if struct.unpack('<I', bom)[0] == BYTE_ORDER_MAGIC:
+                self.__endian = '<'
+            elif struct.unpack('>I', bom)[0] == BYTE_ORDER_MAGIC:
+                self.__endian = '>'
+            else:
+                raise ValueError('invalid pcapng byte-order magic')
+            self.interfaces = []
+            blocktype = BT_SHB
+            length = struct.unpack(self.__endian + 'I', head[4:])[0]
+            rest = bom + self.__f.read(length - 12)
+        elif first:
+            return None, None
+        else:
+            blocktype, length = struct.unpack(self.__endian + 'II', head)
+            rest = self.__f.read(length - 8)
+        if length < 12 or len(rest) < length - 8:
+            log.warning('pcapng: truncated block in %s' % self.name)
+            return None, None
+        return blocktype, rest[:-4]
+
+    def __add_interface(self, body):
+        '''
+        Parses an Interface Description Block and adds it to self.interfaces.
+        '''
+        endian = self.__endian
+        linktype, _, snaplen = struct.unpack(endian + 'HHI', body[:8])
+        iface = Interface(linktype, snaplen)
+        offset = 8
+        while offset + 4 <= len(body):
+            code, length = struct.unpack(endian + 'HH', body[offset:offset+4])
+            value = body[offset+4:offset+4+length]
+            if code == OPT_ENDOFOPT:
+                break
+            elif code == IF_TSRESOL and length == 1:
+                resol = ord(value)
+                if resol & 0x80:
+                    iface.tsresol = 2 ** (resol & 0x7f)
+                else:
+                    iface.tsresol = 10 ** resol
+            elif code == IF_TSOFFSET and length == 8:
+                iface.tsoffset = struct.unpack(endian + 'q', value)[0]
+            # options are padded to 32 bits
+            offset += 4 + ((length + 3) & ~3)
+        self.interfaces.append(iface)
+
+    def __iter__(self):
+        endian = self.__endian
+        while True:
+            blocktype, body = self.__read_block()
+            if blocktype is None:
+                break
+            if blocktype == BT_SHB:
+                endian = self.__endian
+                continue
+            elif blocktype == BT_IDB:
+                self.__add_interface(body)
+                continue
+            elif blocktype == BT_EPB:
+                ifid, ts_high, ts_low, caplen, length = struct.unpack(
+                    endian + 'IIIII', body[:20])
+            elif blocktype == BT_PB:
+                ifid, _, ts_high, ts_low, caplen, length = struct.unpack(
+                    endian + 'HHIIII', body[:20])
+            elif blocktype == BT_SPB:
+                log.warning('pcapng: skipping Simple Packet Block, it has no '
+                            'timestamp')
+                continue
+            else:
+                # statistics, name resolution, custom blocks, etc.
+                continue
+            try:
+                iface = self.interfaces[ifid]
+            except IndexError:
+                log.warning('pcapng: packet from unknown interface %d' % ifid)
+                continue
+            ticks = (ts_high << 32) | ts_low
+            sec, frac = divmod(ticks, iface.tsresol)
+            sec += iface.tsoffset
+            usec = frac * 1000000 // iface.tsresol
+            yield (sec + float(frac) / iface.tsresol, body[20:20+caplen],
+                   PktHdr(sec, usec, caplen, length, iface.linktype))
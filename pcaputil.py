@@ -2,9 +2,29 @@
 Various small, useful functions which have no other home.
 '''
 
+import bz2
 import dpkt
+import heapq
+import io
+import logging as log
+import mmap
+import pcapng
+import struct
+import sys
+import zlib
+from readerbase import PktHdr, ReaderMixin
 from socket import inet_ntoa
 
+# lzma is only in the standard library from python 3.3. without it, .xz
+# captures can't be read
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
 def friendly_tcp_flags(flags):
     '''
     returns a string containing a user-friendly representation of the tcp flags
@@ -51,7 +71,7 @@ def ms_from_dpkt_time(td):
     '''
     return int(td * 1000) # um, I guess
 
-class ModifiedReader(object):
+class ModifiedReader(ReaderMixin):
     '''
     A copy of the dpkt pcap Reader. The only change is that the iterator
     yields the pcap packet header as well, so it's possible to check the true
@@ -73,7 +93,7 @@ class ModifiedReader(object):
         elif self.__fh.magic != dpkt.pcap.TCPDUMP_MAGIC:
             raise ValueError, 'invalid tcpdump header'
         self.snaplen = self.__fh.snaplen
-        self.dloff = dpkt.pcap.dltoff[self.__fh.linktype]
+        self.dloff = dpkt.pcap.dltoff.get(self.__fh.linktype)
         self.filter = ''
 
     def fileno(self):
@@ -82,12 +102,6 @@ class ModifiedReader(object):
     def datalink(self):
         return self.__fh.linktype
 
-    def setfilter(self, value, optimize=1):
-        return NotImplementedError
-
-    def readpkts(self):
-        return list(self)
-
     def dispatch(self, cnt, callback, *args):
         if cnt > 0:
             for i in range(cnt):
@@ -108,3 +122,319 @@ class ModifiedReader(object):
             hdr = self.__ph(buf)
             buf = self.__f.read(hdr.caplen)
             yield (hdr.tv_sec + (hdr.tv_usec / 1000000.0), buf, hdr)
+
+def parse_file_header(buf):
+    '''
+    Parses a libpcap file header. Returns (dpkt.pcap.FileHdr or LEFileHdr,
+    struct.Struct for unpacking the record headers that follow it into
+    (tv_sec, tv_usec, caplen, len)).
+    '''
+    fh = dpkt.pcap.FileHdr(buf)
+    if fh.magic == dpkt.pcap.PMUDPCT_MAGIC:
+        return dpkt.pcap.LEFileHdr(buf), struct.Struct('<IIII')
+    elif fh.magic == dpkt.pcap.TCPDUMP_MAGIC:
+        return fh, struct.Struct('>IIII')
+    else:
+        raise ValueError, 'invalid tcpdump header'
+
+class MmapReader(ModifiedReader):
+    '''
+    A ModifiedReader that memory-maps the whole capture instead of calling
+    read() twice per packet. Record headers are unpacked in place, and frame
+    data is yielded as a buffer into the mapping, so nothing is copied until
+    something slices it.
+
+    Yields the same (ts, buf, hdr) tuples as ModifiedReader, except that hdr
+    is a readerbase.PktHdr. Raises the same errors as mmap.mmap if the file
+    can't be mapped, see open_reader.
+    '''
+
+    def __init__(self, fileobj):
+        self.name = fileobj.name
+        self.fd = fileobj.fileno()
+        self.__map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        fh, self.__ph = parse_file_header(
+            self.__map[:dpkt.pcap.FileHdr.__hdr_len__])
+        self.linktype = fh.linktype
+        self.snaplen = fh.snaplen
+        self.dloff = dpkt.pcap.dltoff.get(fh.linktype)
+        self.filter = ''
+
+    def datalink(self):
+        return self.linktype
+
+    def __iter__(self):
+        mapping = self.__map
+        size = len(mapping)
+        unpack_from = self.__ph.unpack_from
+        ph_len = self.__ph.size
+        offset = dpkt.pcap.FileHdr.__hdr_len__
+        while offset < size:
+            if offset + ph_len > size:
+                log.warning('MmapReader: truncated record header at end of %s'
+                            % self.name)
+                break
+            sec, usec, caplen, length = unpack_from(mapping, offset)
+            offset += ph_len
+            if offset + caplen > size:
+                log.warning('MmapReader: truncated packet at end of %s'
+                            % self.name)
+                break
+            yield (sec + (usec / 1000000.0), buffer(mapping, offset, caplen),
+                   PktHdr(sec, usec, caplen, length, self.linktype))
+            offset += caplen
+
+    def records(self):
+        '''
+        Like iterating over the reader, but yields (offset, ts, buf, hdr),
+        where offset is the file offset of the record, for read_at.
+        '''
+        mapping = self.__map
+        size = len(mapping)
+        unpack_from = self.__ph.unpack_from
+        ph_len = self.__ph.size
+        offset = dpkt.pcap.FileHdr.__hdr_len__
+        while offset + ph_len <= size:
+            sec, usec, caplen, length = unpack_from(mapping, offset)
+            if offset + ph_len + caplen > size:
+                break
+            yield (offset, sec + (usec / 1000000.0),
+                   buffer(mapping, offset + ph_len, caplen),
+                   PktHdr(sec, usec, caplen, length, self.linktype))
+            offset += ph_len + caplen
+
+    def read_at(self, offsets):
+        '''
+        Yields (ts, buf, hdr) for just the records at the passed file offsets,
+        as returned by records(), in the order given.
+        '''
+        mapping = self.__map
+        unpack_from = self.__ph.unpack_from
+        ph_len = self.__ph.size
+        for offset in offsets:
+            sec, usec, caplen, length = unpack_from(mapping, offset)
+            yield (sec + (usec / 1000000.0),
+                   buffer(mapping, offset + ph_len, caplen),
+                   PktHdr(sec, usec, caplen, length, self.linktype))
+
+class StreamReader(ModifiedReader):
+    '''
+    A ModifiedReader for file objects that can only be read from start to
+    finish, like pipes and decompressed streams. Never seeks or asks for
+    fileno(), so fileobj should be buffered; open_reader takes care of that.
+    A partial record at the end of the stream is dropped with a warning.
+
+    Yields the same (ts, buf, hdr) tuples as MmapReader.
+    '''
+
+    def __init__(self, fileobj):
+        self.name = getattr(fileobj, 'name', '<stream>')
+        self.fd = None
+        self.__f = fileobj
+        fh, self.__ph = parse_file_header(
+            fileobj.read(dpkt.pcap.FileHdr.__hdr_len__))
+        self.linktype = fh.linktype
+        self.snaplen = fh.snaplen
+        self.dloff = dpkt.pcap.dltoff.get(fh.linktype)
+        self.filter = ''
+
+    def datalink(self):
+        return self.linktype
+
+    def __iter__(self):
+        read = self.__f.read
+        unpack = self.__ph.unpack
+        ph_len = self.__ph.size
+        while 1:
+            buf = read(ph_len)
+            if len(buf) < ph_len:
+                if buf:
+                    log.warning('StreamReader: truncated record header at '
+                                'end of %s' % self.name)
+                break
+            sec, usec, caplen, length = unpack(buf)
+            buf = read(caplen)
+            if len(buf) < caplen:
+                # usually the writer was killed, or the pipe closed mid-packet
+                log.warning('StreamReader: truncated packet at end of %s'
+                            % self.name)
+                break
+            yield (sec + (usec / 1000000.0), buf,
+                   PktHdr(sec, usec, caplen, length, self.linktype))
+
+class DecompressedStream(io.RawIOBase):
+    '''
+    Raw, read-only stream of the decompressed contents of fileobj. Reads the
+    compressed data in big chunks and decompresses it incrementally, so the
+    whole file never has to be in memory or on disk. Concatenated members, as
+    made by `cat a.gz b.gz` or pbzip2, are decompressed one after the other.
+    Anything after a member that doesn't start with magic, like the zero
+    padding some tools add, ends the stream with a warning.
+
+    Wrap it in an io.BufferedReader before reading packets from it.
+    '''
+
+    def __init__(self, fileobj, decompressor, magic, chunksize=1<<20):
+        '''
+        Args:
+        fileobj = compressed file object
+        decompressor = callable returning a new zlib/bz2/lzma decompressor
+        magic = bytes every member starts with
+        chunksize = how much compressed data to read at a time
+        '''
+        io.RawIOBase.__init__(self)
+        self.name = getattr(fileobj, 'name', '<stream>')
+        self.__f = fileobj
+        self.__new = decompressor
+        self.__d = decompressor()
+        self.__magic = magic
+        self.__chunksize = chunksize
+        self.__pending = '' # decompressed data not read yet
+        self.__pos = 0 # index of the first unread byte in __pending
+        self.__ended = False # whether __d has reached the end of its member
+        self.__partial = '' # start of the next member's magic
+        self.__done = False # whether trailing junk was found
+
+    def readable(self):
+        return True
+
+    def __decompress(self, data):
+        '''
+        Decompresses data, starting new decompressors at member boundaries.
+        '''
+        out = []
+        data = self.__partial + data
+        self.__partial = ''
+        magic = self.__magic
+        while data:
+            if self.__ended:
+                if len(data) < len(magic) and magic.startswith(data):
+                    # the rest of the magic is in the next chunk
+                    self.__partial = data
+                    break
+                if not data.startswith(magic):
+                    log.warning('ignoring data after the last compressed '
+                                'member of %s' % self.name)
+                    self.__done = True
+                    break
+                self.__d = self.__new()
+                self.__ended = False
+            try:
+                out.append(self.__d.decompress(data))
+            except EOFError:
+                # bz2 and lzma refuse data after the end of a stream
+                self.__ended = True
+                continue
+            data = self.__d.unused_data
+            if data:
+                self.__ended = True
+        return ''.join(out)
+
+    def readinto(self, b):
+        while self.__pos >= len(self.__pending):
+            data = not self.__done and self.__f.read(self.__chunksize)
+            if not data:
+                if self.__partial:
+                    log.warning('ignoring data after the last compressed '
+                                'member of %s' % self.name)
+                    self.__partial = ''
+                return 0
+            self.__pending = self.__decompress(data)
+            self.__pos = 0
+        n = min(len(b), len(self.__pending) - self.__pos)
+        b[:n] = self.__pending[self.__pos:self.__pos+n]
+        self.__pos += n
+        return n
+
+# (magic bytes, decompressor factory) for compressed captures
+COMPRESSION_MAGIC = [
+    ('\x1f\x8b', lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)), # gzip
+    ('BZh', bz2.BZ2Decompressor),
+    ('\xfd7zXZ\x00', lzma and lzma.LZMADecompressor), # xz
+]
+MAGIC_LEN = max(len(m) for m, _ in COMPRESSION_MAGIC)
+
+def open_stdin():
+    '''
+    Returns stdin as a binary file object with a large buffer, suitable for
+    open_reader. This is how `tcpdump -w - | main.py - out.har` works.
+    '''
+    f = io.open(sys.stdin.fileno(), 'rb', 1<<20, closefd=False)
+    f.raw.name = '<stdin>' # rather than the fd, for log messages
+    return f
+
+def open_reader(fileobj):
+    '''
+    Returns a pcap reader for fileobj: a pcapng.Reader for pcapng files, an
+    MmapReader if the file can be mapped, or a StreamReader for things like
+    pipes and empty files. Compressed files are decompressed on the fly and
+    read with a StreamReader or pcapng.Reader.
+
+    fileobj must either be seekable or have peek(), like io.BufferedReader.
+    '''
+    if hasattr(fileobj, 'peek'):
+        magic = fileobj.peek(MAGIC_LEN)[:MAGIC_LEN]
+    else:
+        magic = fileobj.read(MAGIC_LEN)
+        fileobj.seek(0)
+    for prefix, decompressor in COMPRESSION_MAGIC:
+        if magic.startswith(prefix):
+            if not decompressor:
+                raise ValueError('reading xz captures needs the lzma module')
+            stream = io.BufferedReader(
+                DecompressedStream(fileobj, decompressor, prefix), 1<<20)
+            if stream.peek(len(pcapng.MAGIC)).startswith(pcapng.MAGIC):
+                return pcapng.Reader(stream)
+            return StreamReader(stream)
+    if magic.startswith(pcapng.MAGIC):
+        return pcapng.Reader(fileobj)
+    try:
+        return MmapReader(fileobj)
+    except (AttributeError, EnvironmentError, ValueError):
+        # mmap.error is an EnvironmentError. fileobj has not been read from,
+        # so StreamReader starts at the right place
+        return StreamReader(fileobj)
+
+class MergedReader(ReaderMixin):
+    '''
+    Reads several pcap readers as if they were one capture, yielding their
+    packets in timestamp order. Meant for rotated captures (tcpdump -C) and
+    for interfaces captured into separate files.
+
+    Each reader must be in chronological order itself. Only the next packet
+    of each reader is held, in a heap, so memory use doesn't depend on the
+    size of the files. Packets with equal timestamps come out in the order
+    the readers were passed. hdr.linktype is always set.
+    '''
+
+    def __init__(self, readers):
+        '''
+        readers = [reader], any readers returned by open_reader
+        '''
+        self.readers = readers
+        self.name = ', '.join(r.name for r in readers)
+        self.filter = ''
+
+    def datalink(self):
+        return self.readers[0].datalink() if self.readers else None
+
+    def __iter__(self):
+        heap = []
+        for i, reader in enumerate(self.readers):
+            it = iter(reader)
+            for ts, buf, hdr in it:
+                heap.append((ts, i, buf, hdr, it, reader.datalink()))
+                break
+        heapq.heapify(heap)
+        while heap:
+            ts, i, buf, hdr, it, datalink = heap[0]
+            if not hasattr(hdr, 'linktype'):
+                # dpkt.pcap.PktHdr, from a plain ModifiedReader
+                hdr = PktHdr(hdr.tv_sec, hdr.tv_usec, hdr.caplen, hdr.len,
+                             datalink)
+            yield (ts, buf, hdr)
+            for ts, buf, hdr in it:
+                heapq.heapreplace(heap, (ts, i, buf, hdr, it, datalink))
+                break
+            else:
+                heapq.heappop(heap)
@@ -0,0 +1,28 @@
+'''
+What the capture readers in pcaputil and pcapng have in common.
+'''
+
+import capfilter
+from collections import namedtuple
+
+# stand-in for dpkt.pcap.PktHdr, cheap enough to build for every packet. Has
+# the link type too, since it can change from packet to packet in pcapng
+# files, and packets from different files can be mixed
+PktHdr = namedtuple('PktHdr', 'tv_sec tv_usec caplen len linktype')
+
+class ReaderMixin(object):
+    '''
+    setfilter and readpkts, like dpkt.pcap.Reader's, for readers that yield
+    (ts, buf, hdr) tuples and set self.filter = '' in __init__.
+    '''
+
+    def setfilter(self, value, optimize=1):
+        '''
+        Sets a capfilter expression, which pcap.ParsePcap applies to the raw
+        frames. Raises capfilter.FilterError if it is invalid.
+        '''
+        capfilter.Filter(value)
+        self.filter = value
+
+    def readpkts(self):
+        return list(self)
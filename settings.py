@@ -1 +1,10 @@
-process_pages = True
\ No newline at end of file
+process_pages = True
+keep_tcp_packets = False
+flow_idle_timeout = None
+max_tcp_flows = None
+reorder_window = 0.01
+max_memory = None
+body_cap = None
+sniff_http = True
+stream_http = True
+include_content = True
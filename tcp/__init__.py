@@ -8,8 +8,10 @@ import dpkt
 from packet import Packet
 from flow import Flow
 from chunk import Chunk
+from arrival import ArrivalMap
 from direction import Direction
 from flowbuilder import FlowBuilder
+from reorder import ReorderBuffer
 
 # util functions
 
@@ -27,7 +29,7 @@ def detect_handshake(packets):
     syn, synack, ack = packets
     fwd_seq = None
     rev_seq = None
-    if syn.tcp.flags & dpkt.tcp.TH_SYN and not syn.tcp.flags & dpkt.tcp.TH_ACK:
+    if syn.flags & dpkt.tcp.TH_SYN and not syn.flags & dpkt.tcp.TH_ACK:
         # have syn
         fwd_seq = syn.seq # start_seq is the seq field of the segment
         if (synack.flags & dpkt.tcp.TH_SYN and
@@ -0,0 +1,55 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# 'q' only exists from python 3.3. a C long is 64 bits on most 64-bit
+# platforms, and a double holds integers exactly up to 2**53 otherwise
+try:
+    SEQ_TYPECODE = array('q').typecode
+except ValueError:
+    SEQ_TYPECODE = 'l' if array('l').itemsize >= 8 else 'd'
+
+class ArrivalMap(object):
+    '''
+    Maps sequence numbers to the times data arrived, for tcp.Direction.
+
+    Entries are kept sorted by sequence number in two parallel arrays, which
+    take 16 bytes an entry instead of a tuple and a list slot or two. Data
+    mostly arrives in order, so inserting is usually an append. An entry with
+    the same sequence number as existing ones goes before them, so find_le
+    returns the earliest one added, like SortedCollection did.
+
+    Members:
+    * seqs = array(SEQ_TYPECODE), sequence numbers, sorted
+    * times = array('d'), the timestamp for each of seqs
+    '''
+    def __init__(self):
+        self.seqs = array(SEQ_TYPECODE)
+        self.times = array('d')
+
+    def insert(self, seq_num, ts):
+        if not self.seqs or seq_num > self.seqs[-1]:
+            self.seqs.append(seq_num)
+            self.times.append(ts)
+        else:
+            i = bisect_left(self.seqs, seq_num)
+            self.seqs.insert(i, seq_num)
+            self.times.insert(i, ts)
+
+    def find_le(self, seq_num):
+        '''
+        Returns the timestamp of the last entry with a sequence number less
+        than or equal to seq_num, or None if there is none.
+        '''
+        i = bisect_right(self.seqs, seq_num)
+        if i:
+            return self.times[i-1]
+        return None
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def __iter__(self):
+        '''
+        Yields (seq_num, ts) in order.
+        '''
+        return iter(zip(self.seqs, self.times))
@@ -1,26 +1,138 @@
-import seq
+import mmap
+import shutil
+import tempfile
 
 class Chunk:
     '''
     A chunk of data from a TCP stream in the process of being merged. Takes the
     place of the data tuples, ((begin, end), data, logger) in the old algorithm.
     Adds member functions that encapsulate the main merging logic.
+
+    New data is kept as a list of segments rather than concatenated onto one
+    string as it arrives, which would copy the whole chunk for every packet.
+    The segments are joined when data is read, and the result replaces them,
+    so reading it again is free.
+
+    A chunk can be spilled to a temporary file, to take its data out of
+    memory. After that, new data is written to the file, and data is an mmap
+    of it.
+
+    Members:
+    * segments = [string], the chunk's data in order, while it is in memory
+    * spill_file = file or None, the temporary file holding the data
+    * data = string, all of the chunk's data, or a read-only mmap.mmap if it
+    has been spilled
+    * memory_size = bytes of data held in memory, kept up to date as data is
+    added, filtered, released and spilled
+    * filter = callable(string) -> string or None. If set, new data at the
+    back of the chunk goes through it, and seq_end - seq_start can be more
+    than the length of data. See set_filter.
+    * seq_start, seq_end = stream offsets of the data, slice-style, or None
+    if there is no data yet. These are unwrapped, see tcp.Direction, so they
+    compare as plain integers
     '''
     def __init__(self):
         '''
         Basic initialization on the chunk.
         '''
-        self.data = ''
+        self.segments = []
         self.seq_start = None
         self.seq_end = None
+        self.spill_file = None
+        self.spill_map = None
+        self.filter = None
+        self.memory_size = 0
+
+    @property
+    def data(self):
+        if self.spill_file:
+            if self.spill_map is None:
+                self.spill_file.flush()
+                self.spill_map = mmap.mmap(self.spill_file.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+            return self.spill_map
+        if len(self.segments) > 1:
+            self.segments = [''.join(self.segments)]
+        return self.segments[0] if self.segments else ''
+
+    def set_filter(self, filter):
+        '''
+        Passes the data through filter, and everything added at the back
+        from now on.
+        '''
+        data = self.data[:]
+        if self.spill_file:
+            self.spill_file.close()
+            self.spill_file = None
+            self.spill_map = None
+        data = filter(data) if data else ''
+        self.segments = [data] if data else []
+        self.memory_size = len(data)
+        self.filter = filter
+
+    def release(self, length):
+        '''
+        Drops the first length bytes of data. seq_start stays where it was,
+        so that later packets are still merged in the right place.
+        '''
+        rest = self.data[length:]
+        if self.spill_file:
+            # what's left is usually small; if not, it can be spilled again
+            self.spill_file.close()
+            self.spill_file = None
+            self.spill_map = None
+        self.segments = [rest] if rest else []
+        self.memory_size = len(rest)
+
+    def spill(self):
+        '''
+        Moves the data to a temporary file, which is deleted when it is closed
+        or the chunk goes away.
+        '''
+        if self.spill_file or not self.segments:
+            return
+        f = tempfile.TemporaryFile()
+        for segment in self.segments:
+            f.write(segment)
+        self.segments = []
+        self.memory_size = 0
+        self.spill_file = f
+
+    def append(self, data):
+        if self.filter:
+            data = self.filter(data)
+            if not data:
+                return
+        if self.spill_file:
+            self.spill_file.write(data)
+            self.spill_map = None
+        else:
+            self.segments.append(data)
+            self.memory_size += len(data)
+
+    def prepend(self, data):
+        if self.spill_file:
+            # files can't grow at the front, so copy it to a new one. it
+            # only happens when the start of a spilled chunk arrives late
+            f = tempfile.TemporaryFile()
+            f.write(data)
+            self.spill_file.flush()
+            self.spill_file.seek(0)
+            shutil.copyfileobj(self.spill_file, f)
+            self.spill_file.close()
+            self.spill_file = f
+            self.spill_map = None
+        else:
+            self.segments.insert(0, data)
+            self.memory_size += len(data)
 
     def merge(self, new, new_seq_callback = None):
         '''
-        Attempts to merge the packet or chunk with the existing data. Returns
+        Attempts to merge the chunk with the existing data. Returns
         details of the operation's success or failure.
 
         Args:
-        new = TCPPacket or TCPChunk
+        new = TCPChunk
         new_seq_callback = callable(int) or None
 
         new_seq_callback is a function that will be called with sequence numbers
@@ -37,19 +149,30 @@ class Chunk:
         Note that (True, (False, False)) is a valid value, which indicates that
         the new data was completely inside the existing data
         '''
+        return self.merge_data(new.seq_start, new.data, new_seq_callback)
+
+    def merge_data(self, seq_start, data, new_seq_callback = None):
+        '''
+        Like merge, for data starting at stream offset seq_start, such as a
+        packet's.
+        '''
         # if we have actual data yet (maybe false if there was no init packet)
-        if new.data:
+        if data:
+            seq_end = seq_start + len(data)
             # assume self.seq_* are also valid
-            if self.data:
-                return self.inner_merge((new.seq_start, new.seq_end),
-                                        new.data, new_seq_callback)
+            if self.seq_start is not None:
+                return self.inner_merge((seq_start, seq_end),
+                                        data, new_seq_callback)
             else:
-                # if they have data and we don't, just steal theirs
-                self.data = new.data
-                self.seq_start = new.seq_start
-                self.seq_end = new.seq_end
+                # if they have data and we don't, just steal theirs. [:]
+                # copies it out of the frame if it's a buffer from
+                # decoder.decode_tcp, or out of another chunk's mmap
+                self.segments = [data[:]]
+                self.memory_size = len(data)
+                self.seq_start = seq_start
+                self.seq_end = seq_end
                 if new_seq_callback:
-                    new_seq_callback(new.seq_start)
+                    new_seq_callback(seq_start)
                 return (True, (True, True))
         # else, there is no data anywhere
         return (False, (False, False))
@@ -73,11 +196,10 @@ class Chunk:
         added_front_data = False
         added_back_data = False
         # front data?
-        if (seq.lt(newseq[0], self.seq_start) and
-            seq.lte(self.seq_start, newseq[1])):
-            new_data_length = seq.subtract(self.seq_start, newseq[0])
+        if newseq[0] < self.seq_start <= newseq[1]:
+            new_data_length = self.seq_start - newseq[0]
             # slice out new data, stick it on the front
-            self.data = newdata[:new_data_length] + self.data
+            self.prepend(newdata[:new_data_length])
             self.seq_start = newseq[0]
             # notifications
             overlapped = True
@@ -85,9 +207,9 @@ class Chunk:
             if callback:
                 callback(newseq[0])
         # back data?
-        if seq.lte(newseq[0], self.seq_end) and seq.lt(self.seq_end, newseq[1]):
-            new_data_length = seq.subtract(newseq[1], self.seq_end)
-            self.data += newdata[-new_data_length:]
+        if newseq[0] <= self.seq_end < newseq[1]:
+            new_data_length = newseq[1] - self.seq_end
+            self.append(newdata[-new_data_length:])
             self.seq_end += new_data_length
             # notifications
             overlapped = True
@@ -97,8 +219,7 @@ class Chunk:
                 back_seq_start = newseq[1] - new_data_length
                 callback(back_seq_start)
         # completely inside?
-        if (seq.lte(self.seq_start, newseq[0]) and
-            seq.lte(newseq[1], self.seq_end)):
+        if self.seq_start <= newseq[0] and newseq[1] <= self.seq_end:
             overlapped = True
         # done
         return (overlapped, (added_front_data, added_back_data))
@@ -1,21 +1,55 @@
-from sortedcollection import SortedCollection
+from arrival import ArrivalMap
+import bisect
+import seq
 import tcp
-from operator import itemgetter
+
+# chunks smaller than this are not worth a temporary file of their own
+SPILL_MIN_BYTES = 64 * 1024
 
 class Direction:
     '''
     Represents data moving in one direction in a TCP flow.
 
+    Sequence numbers are unwrapped into 64-bit offsets into the stream as
+    packets arrive, so they can be compared directly, even when the stream
+    wraps around 2**32. Everything below is in offsets, including seq_start,
+    byte_to_seq and the arrival times. Offset 0 is the first byte after the
+    ISN if there was a handshake, or the first data packet to arrive if not.
+
     Members:
     * finished = bool. Indicates whether more packets should be expected.
     * chunks = [tcp.Chunk], sorted by seq_start
+    * chunk_starts = [int], seq_start of each chunk, for bisecting
     * flow = tcp.Flow, the flow to which the direction belongs
-    * arrival_data = SortedCollection([(seq_num, pkt)])
-    * final_arrival_data = SortedCollection([(seq_num, ts)])
+    * arrival_data = tcp.ArrivalMap, when data at each seq_num first arrived
+    * final_arrival_data = tcp.ArrivalMap, when data up to each seq_num had
+      completely arrived
     * final_data_chunk = Chunk or None, the chunk that contains the final data,
       only after seq_start is valid
     * final_arrival_pointer = the end sequence number of data that has
       completely arrived
+    * isn = 32-bit sequence number of offset 0, or None before the first
+      data packet
+    * highest_seq = highest offset seen, which sequence numbers are
+      unwrapped around
+    * skipper = object with a feed(data) method returning the [(start, end)]
+      slices of data to keep, like http.framing.BodySkipper, or None. If set,
+      the data of the final data chunk goes through it as it becomes
+      contiguous, and what it leaves out is missing from self.data.
+      byte_to_seq still maps into the whole stream.
+    * skip_offsets = [int], offsets into self.data where bytes were skipped
+    * skip_totals = [int], bytes skipped up to and including each of
+      skip_offsets, since the start of self.data
+    * kept_bytes = length of self.data, when there is a skipper
+    * consumer = object with feed(tcp.Direction) and finish(tcp.Direction)
+      methods, like http.MessageStream, or None. feed is called whenever
+      the contiguous data might have grown, and finish once the direction
+      is finished. The consumer can release() data it is done with.
+    * released = number of bytes released from the front of the data.
+      self.data and byte offsets into it start after them.
+    * released_skips = bytes skipped in the released data
+    * memory_size = bytes of TCP data held in memory, the sum of the chunks'
+      memory_size, kept up to date as they change
     '''
     def __init__(self, flow):
         '''
@@ -26,17 +60,42 @@ class Direction:
         '''
         self.finished = False
         self.flow = flow
-        self.arrival_data = SortedCollection(key=itemgetter(0))
-        self.final_arrival_data = SortedCollection(key=itemgetter(0))
+        self.arrival_data = ArrivalMap()
+        self.final_arrival_data = ArrivalMap()
         self.final_arrival_pointer = None
         self.chunks = []
+        self.chunk_starts = []
         self.final_data_chunk = None
+        self.isn = None
+        self.highest_seq = 0
+        self.skipper = None
+        self.skip_offsets = []
+        self.skip_totals = []
+        self.kept_bytes = 0
+        self.consumer = None
+        self.released = 0
+        self.released_skips = 0
+        self.memory_size = 0
     def add(self, pkt):
         '''
-        Merge the packet into the first chunk it overlaps with. If data was
-        added to the end of a chunk, attempts to merge the next chunk (if there
-        is one). This way, it is ensured that everything is as fully merged as
-        it can be with the current data.
+        Merges the packet into the data, and tells the consumer, if there is
+        one.
+
+        Args:
+        pkt = tcp.Packet
+        '''
+        self.merge_pkt(pkt)
+        if self.consumer and self.final_data_chunk:
+            self.consumer.feed(self)
+    def merge_pkt(self, pkt):
+        '''
+        Merge the packet into the chunk it overlaps with, then merge any
+        following chunks the packet reached. This way, it is ensured that
+        everything is as fully merged as it can be with the current data.
+
+        Chunks never overlap or touch each other, so the only candidates are
+        the last chunk starting at or before the packet, and the one after it.
+        They are found by bisecting self.chunk_starts.
 
         Args:
         pkt = tcp.Packet
@@ -44,35 +103,58 @@ class Direction:
         if self.finished:
             raise RuntimeError('tried to add packets to a finished tcp.Direction')
         # discard packets with no payload. we don't care about them here
-        if pkt.data == '':
+        if not pkt.data:
             return
-        # attempt to merge packet with existing chunks
-        merged = False
-        for i, chunk in enumerate(self.chunks):
-            overlapped, (front, back) = chunk.merge(pkt,
-                                             self.create_merge_callback(pkt))
-            if overlapped:
-                # check if this packet bridged the gap between two chunks
-                if back and i < (len(self.chunks)-1):
-                    overlapped2, result2 = chunk.merge(self.chunks[i+1])
-                    if overlapped2:
-                        assert( (not result2[0]) and (result2[1]))
-                        del self.chunks[i+1]
-                # if this is the main data chunk, calc final arrival
-                if self.seq_start and chunk.seq_start == self.seq_start:
-                    if front: # packet was first in stream but just now arriving
-                        self.final_arrival_data.insert((self.seq_start, pkt.ts))
-                    if back: # usual case
-                        self.final_arrival_data.insert((self.final_arrival_pointer, pkt.ts))
-                    if not self.final_data_chunk:
-                        self.final_data_chunk = chunk
-                    self.final_arrival_pointer = self.final_data_chunk.seq_end
-                merged = True
-                break # skip further chunks
-        if not merged:
+        start = self.unwrap(pkt.seq)
+        i = bisect.bisect_right(self.chunk_starts, start) - 1
+        if i < 0 or self.chunks[i].seq_end < start:
+            # ends before the packet, so try the next one
+            i += 1
+        if i == len(self.chunks):
+            self.new_chunk(start, pkt)
+            return
+        chunk = self.chunks[i]
+        size = chunk.memory_size
+        overlapped, (front, back) = chunk.merge_data(start, pkt.data,
+                                         self.create_merge_callback(pkt))
+        self.memory_size += chunk.memory_size - size
+        if not overlapped:
             # nothing overlapped with the packet
             # we need a new chunk
-            self.new_chunk(pkt)
+            self.new_chunk(start, pkt)
+            return
+        if front:
+            self.chunk_starts[i] = chunk.seq_start
+        if back:
+            # check if this packet bridged the gap to the following chunks
+            self.coalesce(i)
+        # if this is the main data chunk, calc final arrival
+        if chunk.seq_start == self.seq_start:
+            if front: # packet was first in stream but just now arriving
+                self.final_arrival_data.insert(self.seq_start, pkt.ts)
+            if back and self.final_arrival_pointer is not None: # usual case
+                self.final_arrival_data.insert(self.final_arrival_pointer, pkt.ts)
+            if not self.final_data_chunk:
+                self.set_final_data_chunk(chunk)
+            self.final_arrival_pointer = self.final_data_chunk.seq_end
+    def coalesce(self, i):
+        '''
+        Merges the chunks following self.chunks[i] into it, for as long as they
+        overlap or touch it.
+        '''
+        chunk = self.chunks[i]
+        size = chunk.memory_size
+        j = i + 1
+        while (j < len(self.chunks) and
+               self.chunks[j].seq_start <= chunk.seq_end):
+            size += self.chunks[j].memory_size
+            chunk.merge(self.chunks[j])
+            if self.chunks[j] is self.final_data_chunk:
+                self.final_data_chunk = chunk
+            j += 1
+        self.memory_size += chunk.memory_size - size
+        del self.chunks[i+1:j]
+        del self.chunk_starts[i+1:j]
     @property
     def data(self):
         '''
@@ -85,19 +167,26 @@ class Direction:
                 return '' # no data was ever added
             else:
                 return None # just don't know at all
+    def spill(self):
+        '''
+        Moves the data of chunks of at least SPILL_MIN_BYTES to temporary
+        files. Returns how many bytes were taken out of memory.
+        '''
+        freed = 0
+        for chunk in self.chunks:
+            size = chunk.memory_size
+            if size >= SPILL_MIN_BYTES:
+                chunk.spill()
+                freed += size
+        self.memory_size -= freed
+        return freed
     @property
     def seq_start(self):
         '''
         starting sequence number, as far as we can tell now.
         '''
         if self.flow.handshake:
-            if self is self.flow.fwd:
-                return self.flow.handshake[2].seq
-            elif self is self.flow.rev:
-                return self.flow.handshake[1].seq + 1
-            else:
-                raise RuntimeError(
-                    "holy crap, tcp.Direction has a flow it doesn't belong to")
+            return 0
         elif self.finished:
             if self.chunks:
                 return self.chunks[0].seq_start
@@ -117,33 +206,71 @@ class Direction:
         # calculate final_arrival
         if not self.final_arrival_data:
             peak_time = 0.0
-            for vertex in self.arrival_data:
-                if vertex[1].ts > peak_time:
-                    peak_time = vertex[1].ts
-                    self.final_arrival_data.insert((vertex[0], vertex[1].ts))
+            for seq_num, ts in self.arrival_data:
+                if ts > peak_time:
+                    peak_time = ts
+                    self.final_arrival_data.insert(seq_num, ts)
         if self.chunks and not self.final_data_chunk:
-            self.final_data_chunk = self.chunks[0]
-    def new_chunk(self, pkt):
+            self.set_final_data_chunk(self.chunks[0])
+        if self.consumer:
+            if self.final_data_chunk:
+                self.consumer.feed(self)
+            self.consumer.finish(self)
+    def handshake_isn(self):
+        '''
+        the 32-bit sequence number of the first data byte according to the
+        flow's handshake, or None if it has none.
+        '''
+        if self.flow.handshake:
+            if self is self.flow.fwd:
+                return self.flow.handshake[2].seq
+            elif self is self.flow.rev:
+                return (self.flow.handshake[1].seq + 1) % seq.numberspace
+            else:
+                raise RuntimeError(
+                    "holy crap, tcp.Direction has a flow it doesn't belong to")
+        return None
+    def unwrap(self, seq_num):
+        '''
+        Returns the stream offset of the 32-bit sequence number, taking the
+        one closest to the highest offset seen so far.
+        '''
+        if self.isn is None:
+            self.isn = self.handshake_isn()
+            if self.isn is None:
+                self.isn = seq_num
+        offset = seq.unwrap(seq_num, self.isn, self.highest_seq)
+        if offset > self.highest_seq:
+            self.highest_seq = offset
+        return offset
+    def new_chunk(self, start, pkt):
         '''
         creates a new tcp.Chunk for the pkt to live in. Only called if an
         attempt has been made to merge the packet with all existing chunks.
+
+        Args:
+        start = stream offset of the packet's data
+        pkt = tcp.Packet
         '''
         chunk = tcp.Chunk()
-        chunk.merge(pkt, self.create_merge_callback(pkt))
-        if self.seq_start and chunk.seq_start == self.seq_start:
-            self.final_data_chunk = chunk
+        chunk.merge_data(start, pkt.data, self.create_merge_callback(pkt))
+        self.memory_size += chunk.memory_size
+        if chunk.seq_start == self.seq_start:
+            self.set_final_data_chunk(chunk)
             self.final_arrival_pointer = chunk.seq_end
-            self.final_arrival_data.insert((pkt.seq, pkt.ts))
-        # it would be better to insert the chunk sorted here
-        self.chunks.append(chunk)
-        self.chunks.sort(key=lambda chunk: chunk.seq_start)
+            self.final_arrival_data.insert(start, pkt.ts)
+        i = bisect.bisect_right(self.chunk_starts, chunk.seq_start)
+        self.chunks.insert(i, chunk)
+        self.chunk_starts.insert(i, chunk.seq_start)
     def create_merge_callback(self, pkt):
         '''
         Returns a function that will serve as a callback for Chunk. It will
-        add the passed sequence number and the packet to self.arrival_data.
+        add the passed sequence number and the packet's timestamp to
+        self.arrival_data.
         '''
+        ts = pkt.ts
         def callback(seq_num):
-            self.arrival_data.insert((seq_num, pkt))
+            self.arrival_data.insert(seq_num, ts)
         return callback
     def byte_to_seq(self, byte):
         '''
@@ -153,23 +280,82 @@ class Direction:
         # TODO better handle case where seq_start is None
         seq_start = self.seq_start
         if seq_start is not None:
+            seq_start += self.released + self.released_skips
+            i = bisect.bisect_right(self.skip_offsets, byte)
+            if i:
+                return byte + seq_start + self.skip_totals[i-1]
             return byte + seq_start
         else:
             return None
+    def release(self, length):
+        '''
+        Drops the first length bytes of self.data, once they have been dealt
+        with, so they don't take up memory. The rest of the data and byte
+        offsets into it then start after them.
+        '''
+        chunk = self.final_data_chunk
+        size = chunk.memory_size
+        chunk.release(length)
+        self.memory_size += chunk.memory_size - size
+        self.released += length
+        if self.skipper:
+            self.kept_bytes -= length
+        # skips at the boundary belong to the released data
+        i = bisect.bisect_right(self.skip_offsets, length)
+        if i:
+            skipped = self.skip_totals[i-1]
+            self.released_skips += skipped
+            self.skip_offsets = [o - length for o in self.skip_offsets[i:]]
+            self.skip_totals = [t - skipped for t in self.skip_totals[i:]]
+        elif self.skip_offsets:
+            self.skip_offsets = [o - length for o in self.skip_offsets]
+    def set_final_data_chunk(self, chunk):
+        '''
+        Makes chunk the final data chunk, and starts passing its data through
+        the skipper, if there is one.
+        '''
+        self.final_data_chunk = chunk
+        if self.skipper:
+            size = chunk.memory_size
+            chunk.set_filter(self.keep)
+            self.memory_size += chunk.memory_size - size
+    def keep(self, data):
+        '''
+        Chunk filter for the final data chunk. Passes the next contiguous bytes
+        of the stream through the skipper, records what it skipped, and returns
+        the rest.
+        '''
+        kept = []
+        pos = 0
+        for start, end in self.skipper.feed(data):
+            if start > pos:
+                self.record_skip(start - pos)
+            kept.append(data[start:end])
+            self.kept_bytes += end - start
+            pos = end
+        if pos < len(data):
+            self.record_skip(len(data) - pos)
+        return ''.join(kept)
+    def record_skip(self, length):
+        '''
+        Notes that length bytes were skipped at the current end of self.data.
+        '''
+        total = length + (self.skip_totals[-1] if self.skip_totals else 0)
+        if self.skip_offsets and self.skip_offsets[-1] == self.kept_bytes:
+            self.skip_totals[-1] = total
+        else:
+            self.skip_offsets.append(self.kept_bytes)
+            self.skip_totals.append(total)
     def seq_arrival(self, seq_num):
         '''
-        returns the packet in which the specified sequence number first arrived.
+        returns the time at which the specified sequence number first arrived.
         '''
-        try:
-            return self.arrival_data.find_le(seq_num)[1]
-        except ValueError:
-            return None
+        return self.arrival_data.find_le(seq_num)
     def seq_final_arrival(self, seq_num):
         '''
         Returns the time at which the seq number had fully arrived, that is,
         when all the data before it had also arrived.
         '''
-        try:
-            return self.final_arrival_data.find_le(seq_num)[1]
-        except:
+        if seq_num is None:
             return None
+        return self.final_arrival_data.find_le(seq_num)
@@ -2,6 +2,7 @@ from tcp.direction import Direction
 import tcp
 
 import seq # hopefully no name collisions
+import settings
 from sortedcollection import SortedCollection
 from dpkt.tcp import *
 import logging as log
@@ -15,34 +16,79 @@ class Flow:
     * fwd, rev = tcp.Direction, both sides of the communication stream
     * socket = ((srcip, sport), (dstip, dport)). Used for checking the direction
     of packets. Taken from SYN or first packet.
-    * packets = list of tcp.Packet's, all packets in the flow
+    * packets = list of tcp.Packet's. Only the packets buffered while looking
+    for the handshake, unless keep_packets is set, in which case it's all
+    packets in the flow.
+    * keep_packets = bool, whether to keep every packet in packets. For
+    debugging; it makes memory use grow with the size of the flow.
     * handshake = None or (syn, synack, ack) or False. None while a handshake is
     still being searched for, False when we've given up on finding it.
+    * packet_count = number of packets added
+    * payload_bytes = TCP payload bytes added, both directions, retransmissions
+    included
+    * first_ts, last_ts = timestamps of the first and latest packets
+    * fins = set of (ip, port) endpoints that have sent a FIN
+    * reset = bool, whether a RST has been seen
+    * sniffer = callable(data) or None. If set, it is given the first payload
+    bytes of each direction, and if it returns False for either, the flow is
+    ignored. Only bytes known to start the stream are sniffed: the packet at
+    the handshake's ISN as soon as it arrives, or, without a handshake, the
+    start of the data once the flow finishes, since a packet from the middle
+    of the stream may arrive first.
+    * sniffed = set of the Direction's whose start has been sniffed
+    * ignored = bool, whether the flow's data is being thrown away. Packets
+    are still counted, and FINs and RSTs noted, but fwd and rev stay empty.
     '''
-    def __init__(self):
+    def __init__(self, keep_packets=None):
+        '''
+        keep_packets = bool, or None to use settings.keep_tcp_packets
+        '''
         self.fwd = Direction(self)
         self.rev = Direction(self)
         self.handshake = None
         self.socket = None
         self.packets = []
+        if keep_packets is None:
+            keep_packets = settings.keep_tcp_packets
+        self.keep_packets = keep_packets
+        self.packet_count = 0
+        self.payload_bytes = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.fins = set()
+        self.reset = False
+        self.sniffer = None
+        self.sniffed = set()
+        self.ignored = False
     def add(self, pkt):
         '''
         called for every packet coming in, instead of iterating through
         a list
         '''
         # make sure packet is in time order
-        if len(self.packets): # if we have received packets before...
-            if self.packets[-1].ts > pkt.ts: # if this one is out of order...
+        if self.packet_count: # if we have received packets before...
+            if self.last_ts > pkt.ts: # if this one is out of order...
                 # error out
                 raise ValueError("packet added to tcp.Flow out of "
                                  "chronological order")
-        self.packets.append(pkt)
+        else:
+            self.first_ts = pkt.ts
+        self.last_ts = pkt.ts
+        self.packet_count += 1
+        self.payload_bytes += len(pkt.data)
+        if pkt.flags & TH_FIN:
+            self.fins.add(pkt.socket[0])
+        if pkt.flags & TH_RST:
+            self.reset = True
         # look out for handshake
         # add it to the appropriate direction, if we've found or given up on
         # finding handshake
         if self.handshake is not None:
+            if self.keep_packets:
+                self.packets.append(pkt)
             self.merge_pkt(pkt)
         else: # if handshake is None, we're still looking for a handshake
+            self.packets.append(pkt)
             if len(self.packets) > 13: # or something like that
                 # give up
                 self.handshake = False
@@ -57,19 +103,47 @@ class Flow:
     def flush_packets(self):
         '''
         Flush packet buffer by merging all packets into either fwd or rev.
+        After this, the buffer is only kept if keep_packets is set; the
+        handshake packets are still in self.handshake.
         '''
         for p in self.packets:
             self.merge_pkt(p)
+        if not self.keep_packets:
+            self.packets = []
 
     def merge_pkt(self, pkt):
         '''
         Merges the packet into either the forward or reverse stream, depending
         on its direction.
         '''
+        if self.ignored:
+            return
         if self.samedir(pkt):
-            self.fwd.add(pkt)
+            direction = self.fwd
         else:
-            self.rev.add(pkt)
+            direction = self.rev
+        if (self.sniffer and pkt.data and direction not in self.sniffed and
+            direction.handshake_isn() == pkt.seq):
+            # the first bytes of the direction
+            self.sniffed.add(direction)
+            if not self.sniffer(pkt.data):
+                self.ignore()
+                return
+        direction.add(pkt)
+    def ignore(self):
+        '''
+        Throws away the data so far, and any more that comes.
+        '''
+        self.ignored = True
+        self.fwd = Direction(self)
+        self.rev = Direction(self)
+    @property
+    def closed(self):
+        '''
+        whether the connection has been closed: both sides sent a FIN, or
+        either sent a RST.
+        '''
+        return self.reset or len(self.fins) == 2
     def finish(self):
         '''
         Notifies the flow that there are no more packets. This finalizes the
@@ -81,8 +155,22 @@ class Flow:
             self.handshake = False
             self.socket = self.packets[0].socket
             self.flush_packets()
+        if self.sniffer and not self.handshake:
+            self.sniff_start()
         self.fwd.finish()
         self.rev.finish()
+    def sniff_start(self):
+        '''
+        Sniffs the start of the data of each direction, which without a
+        handshake is only known once all the packets are in.
+        '''
+        for direction in (self.fwd, self.rev):
+            if self.ignored:
+                break
+            if direction.chunks and direction not in self.sniffed:
+                self.sniffed.add(direction)
+                if not self.sniffer(direction.chunks[0].data):
+                    self.ignore()
     def samedir(self, pkt):
         '''
         returns whether the passed packet is in the same direction as the
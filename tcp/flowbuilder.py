@@ -1,5 +1,13 @@
 import tcp
+import settings
 import logging as log
+from collections import OrderedDict
+from dpkt.tcp import TH_SYN, TH_ACK
+
+# how often, in capture time, to look for idle flows and forget closed ones
+SWEEP_INTERVAL = 10.0
+# how long after a flow closed its stray packets are still recognized
+CLOSED_LINGER = 60.0
 
 class FlowBuilder:
     '''
@@ -10,11 +18,91 @@ class FlowBuilder:
     .add(pkt) for each packet. This will find the right tcp.Flow in the dict and
     call .add() on it. This class should be renamed.
 
+    Flows are finished as soon as they are done with, passed to flow_callback
+    and dropped from flowdict, so that only open connections are held in
+    memory. A flow is done when:
+    * it has been closed (see tcp.Flow.closed)
+    * it has had no packets for idle_timeout seconds
+    * a SYN for a new connection arrives on its socket, as happens when ports
+      are reused. The SYN starts a new flow.
+    * max_flows flows are open and a new one starts. The least recently used
+      one is finished to make room.
+    The rest are finished and passed on by finish(). Packets that turn up
+    for a closed flow without a SYN, like the last ACK, are dropped instead of
+    starting a new flow.
+
     Members:
-    flowdict = {socket: tcp.Flow}
+    flowdict = OrderedDict {socket: tcp.Flow}, open flows, least recently
+        used first
+    sockets = {socket: socket}, so that all packets going the same way share
+        one socket tuple instead of each keeping three tuples of their own.
+        Sockets of finished flows are removed.
+    flow_callback = callable(tcp.Flow)
+    finished_flows = [tcp.Flow], the finished flows, if no flow_callback was
+        given
+    idle_timeout = seconds, or None to only finish flows when they close
+    max_flows = int, or None for no limit
+    closed = {socket: ts}, when recently finished flows saw their last packet
+    evicted_count = number of flows finished to stay under max_flows
+    out_of_order_count = number of packets dropped for being older than the
+        latest packet of their flow. Put a tcp.ReorderBuffer in front to
+        avoid that.
+    max_memory = bytes, or None for no limit. When the TCP data of the open
+        flows adds up to more than this, the biggest tcp.Direction's are
+        spilled to temporary files (see tcp.Direction.spill) until it is
+        below half of it.
+    memory_size = how many bytes of TCP data the open flows hold in memory,
+        when there is a max_memory
+    skipper_factory = callable() returning a skipper for each new
+        tcp.Direction (see tcp.Direction.skipper), or None
+    sniffer = tcp.Flow.sniffer for new flows
+    start_callback = callable(tcp.Flow), called with each new flow before
+        its first packet is added, or None
+    ignored_count = number of finished flows whose data was ignored because
+        of the sniffer
+    ignored_bytes = TCP payload bytes of those flows
     '''
-    def __init__(self):
-        self.flowdict = {}
+    def __init__(self, flow_callback=None, idle_timeout=None, max_flows=None,
+                 max_memory=None, skipper_factory=None, sniffer=None,
+                 start_callback=None):
+        '''
+        Args:
+        flow_callback = called with each tcp.Flow once it is finished, or None
+            to collect them in finished_flows
+        idle_timeout = seconds, or None to use settings.flow_idle_timeout
+        max_flows = int, or None to use settings.max_tcp_flows
+        max_memory = bytes, or None to use settings.max_memory
+        skipper_factory = callable(), or None to keep all the data
+        sniffer = callable(data), or None to keep the data of all flows
+        start_callback = callable(tcp.Flow), or None
+        '''
+        self.flowdict = OrderedDict()
+        self.sockets = {}
+        self.finished_flows = []
+        if flow_callback is None:
+            flow_callback = self.finished_flows.append
+        self.flow_callback = flow_callback
+        if idle_timeout is None:
+            idle_timeout = settings.flow_idle_timeout
+        self.idle_timeout = idle_timeout
+        if max_flows is None:
+            max_flows = settings.max_tcp_flows
+        self.max_flows = max_flows
+        if max_memory is None:
+            max_memory = settings.max_memory
+        self.max_memory = max_memory
+        self.skipper_factory = skipper_factory
+        self.sniffer = sniffer
+        self.start_callback = start_callback
+        self.ignored_count = 0
+        self.ignored_bytes = 0
+        self.memory_size = 0
+        self.spill_at = max_memory
+        self.closed = {}
+        self.evicted_count = 0
+        self.out_of_order_count = 0
+        self.next_sweep = None
+        self.last_key = None
     def add(self, pkt):
         '''
         filters out unhandled packets, and sorts the remainder into the correct
@@ -34,14 +122,157 @@ class FlowBuilder:
         if(srcport == 443 or dstport == 443):
             log.warning('https packets are ignored')
             return
-        # sort it into a tcp.Flow in flowdict
+        # find the tcp.Flow in flowdict
         if (src, dst) in self.flowdict:
-            self.flowdict[(src, dst)].add(pkt)
+            key = (src, dst)
         elif (dst, src) in self.flowdict:
-            self.flowdict[(dst, src)].add(pkt)
+            key = (dst, src)
+        elif self.is_stray(pkt):
+            return
         else:
-            newflow = tcp.Flow()
-            newflow.add(pkt)
-            self.flowdict[(src, dst)] = newflow
+            key = None
+        if key and pkt.ts < self.flowdict[key].last_ts:
+            # tcp.Flow only takes packets in order
+            self.out_of_order_count += 1
+            return
+        if key and self.starts_new_flow(self.flowdict[key], pkt):
+            self.finish_flow(key)
+            key = None
+        pkt.socket = self.sockets.setdefault(pkt.socket, pkt.socket)
+        if key:
+            flow = self.flowdict[key]
+            # keep flowdict in LRU order
+            if key != self.last_key:
+                del self.flowdict[key]
+                self.flowdict[key] = flow
+        else:
+            if self.max_flows and len(self.flowdict) >= self.max_flows:
+                self.evicted_count += 1
+                self.finish_flow(next(self.flowdict.iterkeys()))
+            key = (src, dst)
+            flow = tcp.Flow()
+            flow.sniffer = self.sniffer
+            if self.skipper_factory:
+                flow.fwd.skipper = self.skipper_factory()
+                flow.rev.skipper = self.skipper_factory()
+            if self.start_callback:
+                self.start_callback(flow)
+            self.flowdict[key] = flow
+        self.last_key = key
+        if self.max_memory:
+            # count what the flow holds on to, not the packet: duplicates,
+            # skipped bodies and data released by a consumer take up nothing
+            before = flow.fwd.memory_size + flow.rev.memory_size
+            flow.add(pkt)
+            self.memory_size += (flow.fwd.memory_size + flow.rev.memory_size
+                                 - before)
+            if self.memory_size > self.spill_at:
+                self.spill()
+        else:
+            flow.add(pkt)
+        if flow.closed:
+            self.closed[key] = pkt.ts
+            self.finish_flow(key)
+        self.sweep(pkt.ts)
+    def is_stray(self, pkt):
+        '''
+        whether pkt belongs to a flow that has already been finished.
+        '''
+        if not self.closed or pkt.flags & TH_SYN:
+            return False
+        src, dst = pkt.socket
+        return (src, dst) in self.closed or (dst, src) in self.closed
+    def starts_new_flow(self, flow, pkt):
+        '''
+        whether pkt is the SYN of a new connection reusing flow's socket,
+        rather than part of flow: flow is idle, or already had a handshake
+        with another SYN, or gave up looking for one.
+        '''
+        if not pkt.flags & TH_SYN or pkt.flags & TH_ACK:
+            return False
+        if (self.idle_timeout is not None and
+            pkt.ts - flow.last_ts >= self.idle_timeout):
+            return True
+        if flow.handshake:
+            return pkt.seq != flow.handshake[0].seq
+        # None means it is still looking for a handshake, which a
+        # retransmitted SYN might be part of
+        return flow.handshake is False
+    def finish_flow(self, key):
+        '''
+        Finishes the flow, removes it from flowdict and its sockets from
+        sockets, and passes it to flow_callback.
+        '''
+        flow = self.flowdict.pop(key)
+        if key == self.last_key:
+            self.last_key = None
+        src, dst = key
+        self.sockets.pop((src, dst), None)
+        self.sockets.pop((dst, src), None)
+        if self.max_memory:
+            self.memory_size -= flow.fwd.memory_size + flow.rev.memory_size
+            if self.memory_size < self.max_memory:
+                self.spill_at = self.max_memory
+        flow.finish()
+        if flow.ignored:
+            self.ignored_count += 1
+            self.ignored_bytes += flow.payload_bytes
+        self.flow_callback(flow)
+    def spill(self):
+        '''
+        Spills the directions holding the most data until memory_size is
+        under half of max_memory, or there is nothing big enough left to
+        spill.
+        '''
+        directions = [(d.memory_size, d)
+                      for flow in self.flowdict.itervalues()
+                      for d in (flow.fwd, flow.rev)]
+        self.memory_size = sum(size for size, d in directions)
+        directions.sort(key=lambda item: item[0], reverse=True)
+        for size, d in directions:
+            if self.memory_size <= self.max_memory // 2:
+                break
+            self.memory_size -= d.spill()
+        # if lots of small directions are left, don't try again until there
+        # is enough new data to make it worth it
+        self.spill_at = max(self.max_memory,
+                            self.memory_size + self.max_memory // 2)
+    def sweep(self, now):
+        '''
+        Every SWEEP_INTERVAL seconds, finishes flows that have been idle for
+        idle_timeout, and forgets flows that closed over CLOSED_LINGER ago.
+        '''
+        if self.next_sweep is None:
+            self.next_sweep = now + SWEEP_INTERVAL
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + SWEEP_INTERVAL
+        if self.idle_timeout is not None:
+            idle = []
+            # least recently used first, so stop at the first one in use
+            for key, flow in self.flowdict.iteritems():
+                if now - flow.last_ts < self.idle_timeout:
+                    break
+                idle.append(key)
+            for key in idle:
+                self.finish_flow(key)
+        for key, ts in self.closed.items():
+            if now - ts >= CLOSED_LINGER:
+                del self.closed[key]
     def finish(self):
-        map(tcp.Flow.finish, self.flowdict.itervalues())
+        '''
+        Finishes all the flows that are still open.
+        '''
+        for key in self.flowdict.keys():
+            self.finish_flow(key)
+        if self.evicted_count:
+            log.warning('%d TCP flows were finished early to stay under the '
+                        'limit of %d open flows' % (self.evicted_count,
+                                                    self.max_flows))
+        if self.ignored_count:
+            log.info('%d TCP flows did not look like HTTP; their %d bytes of '
+                     'data were thrown away' % (self.ignored_count,
+                                                self.ignored_bytes))
+        if self.out_of_order_count:
+            log.warning('%d TCP packets were dropped for being out of '
+                        'chronological order' % self.out_of_order_count)
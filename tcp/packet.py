@@ -1,60 +1,76 @@
-import dpkt
 from pcaputil import *
 
 class Packet(object):
     '''
     Represents a TCP packet. Copied from pyper, with additions. contains
     socket, timestamp, and data
-    
+
+    Only what the TCP code uses is kept, in __slots__, since tcp.Flow can hold
+    on to a lot of these. In particular the frame and the dpkt objects it was
+    decoded from are not referenced, so they can be freed right away.
+
     Members:
     ts = dpkt timestamp
-    buf = original data from which eth was constructed
-    eth = dpkt.ethernet.Ethernet. Original ethernet frame.
-    ip = dpkt.ip.IP. Original IP packet.
-    tcp = dpkt.tcp.TCP.
     socket = standard socket tuple: ((srcip, sport), (dstip, dport))
-    data = data from TCP segment
     seq, seq_start = sequence number
+    ack = acknowledgement number
+    flags = TCP flags, dpkt.tcp.TH_*
+    data = data from TCP segment. May be a buffer into the original frame
+        (see decoder.decode_tcp); compare with len() or truthiness, not ''.
     seq_end = first sequence number past this packets data (past the end slice
         index style)
     '''
-    def __init__(self, ts, buf, eth, ip, tcp):
+    __slots__ = ('ts', 'socket', 'seq', 'ack', 'flags', 'data')
+
+    def __init__(self, ts, socket, seq, ack, flags, data):
         '''
         Args:
         ts = timestamp
-        buf = original packet data
-        eth = dpkt.ethernet.Ethernet that the packet came from
-        ip  = dpkt.ip.IP that the packet came from
-        tcp = dpkt.tcp.TCP that the packet came from
+        socket = ((srcip, sport), (dstip, dport))
+        seq, ack, flags = TCP header fields
+        data = TCP payload, string or buffer
         '''
         self.ts = ts
-        self.buf = buf
-        self.eth = eth
-        self.ip = ip
-        self.tcp = tcp
-        self.socket = ((self.ip.src, self.tcp.sport),(self.ip.dst, self.tcp.dport))
-        self.data = tcp.data
-        self.seq = tcp.seq
-        self.ack = tcp.ack
-        self.flags = tcp.flags
-        self.seq_start = self.tcp.seq
-        self.seq_end = self.tcp.seq + len(self.tcp.data) # - 1
-        self.rtt = None
+        self.socket = socket
+        self.seq = seq
+        self.ack = ack
+        self.flags = flags
+        self.data = data
+
+    @classmethod
+    def from_dpkt(cls, ts, ip, tcp):
+        '''
+        Makes a Packet from dpkt objects.
+
+        Args:
+        ts = timestamp
+        ip  = dpkt.ip.IP or dpkt.ip6.IP6 that the packet came from
+        tcp = dpkt.tcp.TCP that the packet came from
+        '''
+        return cls(ts, ((ip.src, tcp.sport), (ip.dst, tcp.dport)),
+                   tcp.seq, tcp.ack, tcp.flags, tcp.data)
+
+    @property
+    def seq_start(self):
+        return self.seq
+    @property
+    def seq_end(self):
+        return self.seq + len(self.data)
 
     def __cmp__(self, other):
         return cmp(self.ts, other.ts)
     def __eq__(self, other):
         return not self.__ne__(other)
     def __ne__(self, other):
-        if isinstance(other, TCPPacket):
+        if isinstance(other, Packet):
             return cmp(self, other) != 0
         else:
             return True
     def __repr__(self):
         return 'TCPPacket(%s, %s, seq=%x , ack=%x, data="%s")' % (
             friendly_socket(self.socket),
-            friendly_tcp_flags(self.tcp.flags),
-            self.tcp.seq,
-            self.tcp.ack,
-            friendly_data(self.tcp.data)[:60]
+            friendly_tcp_flags(self.flags),
+            self.seq,
+            self.ack,
+            friendly_data(str(self.data))[:60]
         )
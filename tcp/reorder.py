@@ -0,0 +1,54 @@
+import heapq
+
+class ReorderBuffer(object):
+    '''
+    Puts packets whose timestamps are slightly out of order back in order,
+    without sorting the whole capture.
+
+    Packets are held in a heap until a packet at least window seconds newer
+    has been added, then passed on oldest first. Packets with equal
+    timestamps keep the order they were added in. A packet that is older than
+    one that has already been passed on is too late to be put in its place;
+    it is passed on right away, and counted in late_count.
+
+    Members:
+    * sink = callable(tcp.Packet), where packets are passed on to
+    * window = seconds
+    * late_count = number of packets that came too late to be reordered
+    '''
+    def __init__(self, sink, window):
+        '''
+        Args:
+        sink = callable(tcp.Packet)
+        window = seconds, how far out of order packets can be
+        '''
+        self.sink = sink
+        self.window = window
+        self.late_count = 0
+        self.heap = []
+        self.counter = 0
+        self.newest_ts = None
+        self.released_ts = None
+    def add(self, pkt):
+        ts = pkt.ts
+        if self.released_ts is not None and ts < self.released_ts:
+            self.late_count += 1
+            self.sink(pkt)
+            return
+        if self.newest_ts is None or ts > self.newest_ts:
+            self.newest_ts = ts
+        heapq.heappush(self.heap, (ts, self.counter, pkt))
+        self.counter += 1
+        limit = self.newest_ts - self.window
+        heap = self.heap
+        while heap and heap[0][0] <= limit:
+            self.release(heapq.heappop(heap))
+    def release(self, entry):
+        self.released_ts = entry[0]
+        self.sink(entry[2])
+    def flush(self):
+        '''
+        Passes on all the packets still held, in order.
+        '''
+        while self.heap:
+            self.release(heapq.heappop(self.heap))
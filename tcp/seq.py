@@ -42,6 +42,18 @@ def lte(a, b):
 def gte(a, b):
     return subtract(a, b) >= 0
 
+def unwrap(x, base, near):
+    '''
+    Returns the offset of sequence number x from sequence number base, as an
+    unbounded integer. Of all the offsets that x could be, the one closest to
+    near (another offset from base) is taken, so a stream's offsets keep
+    growing past 2**32 as long as near follows them.
+    '''
+    delta = (x - base - near) % numberspace
+    if delta >= halfspace:
+        delta -= numberspace
+    return near + delta
+
 import unittest
 
 class TestTcpSeqSubtraction(unittest.TestCase):
@@ -64,12 +76,27 @@ class TestLessThan(unittest.TestCase):
     def testLessThan(self):
         self.assertTrue( not lt(100, 10))
         self.assertTrue( lt(0x7fffffff, 0xf0000000))
+
+class TestUnwrap(unittest.TestCase):
+    def testNoWrap(self):
+        self.assertEqual(unwrap(1100, 100, 0), 1000)
+        self.assertEqual(unwrap(100, 100, 5000), 0)
+    def testWrap(self):
+        # stream starts just below 2**32 and continues past it
+        self.assertEqual(unwrap(0x10, 0xfffffff0, 0), 0x20)
+        self.assertEqual(unwrap(0xfffffff8, 0xfffffff0, 0x20), 8)
+        # fourth time around
+        self.assertEqual(unwrap(5, 0, 3 * numberspace), 3 * numberspace + 5)
+        self.assertEqual(unwrap(0xffffffff, 0, 3 * numberspace),
+                         3 * numberspace - 1)
     
 def runtests():
     suite = unittest.TestSuite()
     suite.addTest(TestTcpSeqSubtraction("testNormalSubtraction"))
     suite.addTest(TestTcpSeqSubtraction("testWrappedSubtraction"))
     suite.addTest(TestLessThan("testLessThan"))
+    suite.addTest(TestUnwrap("testNoWrap"))
+    suite.addTest(TestUnwrap("testWrap"))
     #suite.addTest(TestLessThan(""))
     runner = unittest.TextTestRunner()
     runner.run(suite)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+'''
+Measures how much memory a tcp.Packet takes, not counting its payload, and
+fails if that is over the target.
+
+Decodes every TCP packet of a capture (http.pcap by default) and sorts them
+into flows the way pcap.ParsePcap and tcp.FlowBuilder do. Then adds up
+sys.getsizeof of the packets and every object they refer to: the socket
+tuples, address strings, port and sequence numbers, timestamps and payload
+buffer objects. Objects shared between packets are counted once. The
+payload bytes themselves are left out, since they are the same whatever the
+packet looks like.
+
+usage: bench_packet_memory.py [capture]
+'''
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import dpkt
+import pcap
+import pcaputil
+import tcp
+from decoder import decode_tcp
+
+# bytes per packet, on a 64-bit python 2.7
+TARGET = 300
+
+def owned_size(obj, seen):
+    '''
+    sys.getsizeof of obj and everything reachable from it through tuples and
+    slots, skipping objects in seen, which it adds to. Strings only count
+    their header, buffers their own size.
+    '''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, str):
+        return sys.getsizeof('')
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        size += sum(owned_size(o, seen) for o in obj)
+    elif isinstance(obj, tcp.Packet):
+        size += sum(owned_size(getattr(obj, name), seen)
+                    for name in tcp.Packet.__slots__)
+    return size
+
+def main(filename):
+    reader = pcaputil.open_reader(open(filename, 'rb'))
+    builder = tcp.FlowBuilder()
+    packets = []
+    for ts, buf, hdr in reader:
+        pkt = decode_tcp(ts, buf, hdr.linktype)
+        if pkt is None:
+            try:
+                ip = pcap.parse_frame(buf, hdr.linktype).data
+            except dpkt.Error:
+                continue
+            if not isinstance(getattr(ip, 'data', None), dpkt.tcp.TCP):
+                continue
+            pkt = tcp.Packet.from_dpkt(ts, ip, ip.data)
+        builder.add(pkt)
+        packets.append(pkt)
+    if not packets:
+        print 'no TCP packets in %s' % filename
+        return 1
+    seen = set()
+    total = sum(owned_size(p, seen) for p in packets)
+    per_packet = float(total) / len(packets)
+    print '%s: %d TCP packets, %.0f bytes per packet (target %d)' % (
+        filename, len(packets), per_packet, TARGET)
+    return 0 if per_packet <= TARGET else 1
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = os.path.join(os.path.dirname(__file__), 'http.pcap')
+    sys.exit(main(filename))
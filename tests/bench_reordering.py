@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+'''
+Times TCP reassembly of a synthetic flow whose segments arrive heavily out of
+order, and checks that the reassembled data comes out right.
+
+Makes a handshake followed by a number of equal-sized data segments in one
+direction, and feeds them to a tcp.Flow in several arrival orders: in order,
+reversed, shuffled, and every other segment followed by the ones that were
+skipped. The last three leave thousands of holes in the stream at some
+point, so each packet has to find its place among that many tcp.Chunk's.
+The sequence numbers wrap around 2**32 partway through the stream.
+
+usage: bench_reordering.py [segments]
+'''
+
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import dpkt
+import tcp
+
+SEGMENT_SIZE = 100
+CLIENT = ('\x0a\x00\x00\x01', 40000)
+SERVER = ('\x0a\x00\x00\x02', 80)
+# just below 2**32, so the stream wraps around
+ISN = 0xfff00000
+
+def orders(n):
+    '''
+    Yields (name, [segment index]) for each arrival order.
+    '''
+    yield 'in order', range(n)
+    yield 'reversed', range(n-1, -1, -1)
+    shuffled = range(n)
+    random.Random(0).shuffle(shuffled)
+    yield 'shuffled', shuffled
+    yield 'odd then even', range(1, n, 2) + range(0, n, 2)
+
+def make_packets(order):
+    '''
+    Returns the handshake and data packets, in arrival order, and the
+    payload they should reassemble to.
+    '''
+    fwd = (CLIENT, SERVER)
+    rev = (SERVER, CLIENT)
+    packets = [
+        tcp.Packet(0.0, fwd, ISN - 1, 0, dpkt.tcp.TH_SYN, ''),
+        tcp.Packet(0.0, rev, 0, ISN, dpkt.tcp.TH_SYN | dpkt.tcp.TH_ACK, ''),
+        tcp.Packet(0.0, fwd, ISN, 1, dpkt.tcp.TH_ACK, ''),
+    ]
+    payload = ''.join(chr(ord('a') + i % 26) * SEGMENT_SIZE
+                      for i in range(len(order)))
+    for n, i in enumerate(order):
+        off = i * SEGMENT_SIZE
+        packets.append(tcp.Packet(1.0 + n * 1e-6, fwd, (ISN + off) % 2**32, 1,
+                                  dpkt.tcp.TH_ACK,
+                                  payload[off:off+SEGMENT_SIZE]))
+    return packets, payload
+
+def main(n):
+    ok = True
+    for name, order in orders(n):
+        packets, payload = make_packets(order)
+        flow = tcp.Flow()
+        start = time.time()
+        for pkt in packets:
+            flow.add(pkt)
+        flow.finish()
+        elapsed = time.time() - start
+        good = flow.fwd.data == payload
+        ok = ok and good
+        print '%-14s %6d segments  %7.3fs  %s' % (
+            name, n, elapsed, 'ok' if good else 'WRONG DATA')
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sys.exit(main(n))
@@ -4,7 +4,7 @@
 # sure it didn't fail, then if there is an existing har file for that
 # pcap, it diffs them to make sure the pcap didn't change.
 
-for pcap in `ls *.pcap`
+for pcap in `ls *.pcap *.pcapng *.pcap.gz`
 do
 	echo $pcap
 	if ../main.py $pcap $pcap.new.har